@@ -1,5 +1,32 @@
+import importlib
+import io
+import os
+import random
+import select
+import time
 import serial
 
+# optional components, imported on first access as CenterTwo.<name> so that a
+# one-shot read only pays for pyserial and the protocol below
+LAZY_MODULES = ("analytics",
+                "health",
+                "monitor",
+                "processing",
+                "profiling",
+                "quality",
+                "replay",
+                "simulator",
+                "transports")
+
+
+def __getattr__(name):
+    if name in LAZY_MODULES:
+        module = importlib.import_module(name)
+        globals()[name] = module
+        return module
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
 NAK = b'\x15' # negative acknowledge
 ACK = b'\x06' # acknowledge
 ENQ = b'\x05' # enquiry
@@ -10,6 +37,9 @@ LF =  b'\x0a' # line feed
 ACK_ERROR = "Acknowlegment error"
 UNKNOWN_ERROR = "Unknown error"
 INCORRECT_VALUE_ERROR = "Incorrect value"
+TIMEOUT_ERROR = "No response"
+DESYNC_ERROR = "Unexpected response"
+TRANSPORT_ERROR = "Connection error"
 
 # sensor status strings
 SENS_STATUS = ["Measurement data ok",
@@ -21,6 +51,12 @@ SENS_STATUS = ["Measurement data ok",
                "Identification error",
                "ITR error"]
 
+# status codes carrying a pressure value (data ok, under range, over range)
+VALID_STATUS = (0, 1, 2)
+
+# status of a channel without transmitter
+NO_TRANSMITTER = SENS_STATUS.index("No transmitter")
+
 # error status strings
 DEV_ERR = "Device error"
 HW_ERR = "Hardware error (FAIL illum.)"
@@ -45,41 +81,571 @@ QUEUED_ERROR = ["No error",
                 "Transmitter 3 general error",
                 "Transmitter 3 ID error"]
 
+# pressure unit strings
+PRESSURE_UNITS = ["mbar",
+                  "Torr",
+                  "Pascal",
+                  "Micron"]
+
+# number of switching functions (relays)
+SETPOINTS = 4
+
+# size of the preallocated receive buffer used by the fast read path
+BUFFER_SIZE = 128
+
+# pre-encoded commands used by the fast read path
+PRX_COMMAND = b"PRX" + CR + LF
+PR_COMMANDS = {1: b"PR1" + CR + LF,
+               2: b"PR2" + CR + LF,
+               3: b"PR3" + CR + LF}
+# retry budget keys of the fast path commands, the same as the ones of query()
+PR_MNEMONICS = {1: "PR1", 2: "PR2", 3: "PR3"}
+
+
+def parse_pressure(response):
+    """
+    Parse a "s,v,s,v,s,v" response of all transmitters into [status, value] lists.
+    Raises ValueError for a status code outside SENS_STATUS.
+    """
+    fields = response.split(",")
+    codes = [int(s) for s in fields[0::2]]
+    for code in codes:
+        if code not in range(len(SENS_STATUS)):
+            raise ValueError("Unknown sensor status {:d}".format(code))
+    status = [SENS_STATUS[code] for code in codes]
+    value = [float(v) for v in fields[1::2]]
+    return [status, value]
+
+def parse_setpoint(response):
+    """
+    Parse a "a,b,c" switching function response into [channel, lower, upper].
+    """
+    r_channel, r_lower, r_upper = response.split(",")
+    return [int(r_channel), float(r_lower), float(r_upper)]
+
+
+def parse_error_status(response):
+    """
+    Check that an ERR response holds the four "abcd" 0/1 flags.
+    """
+    if len(response) != 4 or response.strip("01"):
+        raise ValueError("Invalid error status {!r}".format(response))
+    return response
+
+def decode_error_status(status):
+    """
+    Decode the "abcd" flags returned by ERR into a list of error strings.
+    """
+    errors = []
+    if status[0] == '1':
+        errors.append(DEV_ERR)
+    if status[1] == '1':
+        errors.append(HW_ERR)
+    if status[2] == '1':
+        errors.append(INV_PAR)
+    if status[3] == '1':
+        errors.append(STX_ERR)
+    if status == '0000':
+        errors.append(NO_ERR)
+    return errors
+
+
+class CenterTwoError(Exception):
+    """
+    Base class of the errors raised by Controller.
+    """
+    pass
+
+
+class NakError(CenterTwoError):
+    """
+    The controller answered a command with NAK.
+    """
+    pass
+
+
+class ResponseTimeoutError(CenterTwoError, TimeoutError):
+    """
+    No answer within the serial timeout.
+    """
+    pass
+
+
+class DesyncError(CenterTwoError):
+    """
+    The answer does not match the protocol state, e.g. data where an
+    acknowledgement was expected or a malformed response.
+    """
+    pass
+
+
+class TransportError(CenterTwoError):
+    """
+    The connection itself failed: serial port gone, TCP connection closed.
+    Not retried, the connection has to be reopened (see Controller.reconnect).
+    """
+    pass
+
+
+class VerificationError(CenterTwoError):
+    """
+    The value read back after setting a parameter differs from the one sent.
+    """
+    pass
+
+
+class InvalidParameterError(CenterTwoError, ValueError):
+    """
+    A parameter is out of the range accepted by the controller, detected before
+    anything is sent.
+    """
+    pass
+
+
+class DeviceError(CenterTwoError):
+    """
+    The controller reports an error in its ERR status.
+
+    Attributes:
+    status (str): the raw "abcd" ERR flags.
+    errors (list): the decoded error strings.
+    """
+
+    def __init__(self, status, errors):
+        super().__init__(", ".join(errors))
+        self.status = status
+        self.errors = errors
+
+
+class RetryPolicy():
+    """
+    How Controller retries a command failing with NakError or DesyncError, and
+    with ResponseTimeoutError if retry_timeouts is set. Between attempts the link
+    is recovered (see Controller.recover) and the policy sleeps an exponentially
+    growing, jittered delay.
+
+    Timeouts are not retried by default: a silent device would otherwise stall a
+    read for attempts times the serial timeout.
+
+    Parameters:
+    attempts (int): attempts per command, the first one included.
+    backoff (float): delay before the first retry in seconds, doubled at every retry.
+    max_backoff (float): upper limit of the delay in seconds.
+    jitter (float): fraction of the delay drawn at random, 0 to 1.
+    budgets (dict): attempts per command overriding attempts, keyed by the first
+                    three characters of the command as sent, e.g. {"PRX": 1, "PR2": 5,
+                    "SP1": 2}. The fast path methods use the same keys.
+    deadline (float): seconds after the first attempt past which a command is not
+                      retried anymore, None for no limit.
+    timeout (float): serial timeout of a single attempt in seconds, set on the
+                     connection by Controller. None keeps the timeout given to
+                     Controller.connect.
+    retry_timeouts (bool): also retry commands failing with ResponseTimeoutError.
+
+    Attributes:
+    retries (int): retries made, counted over every command run with the policy.
+    failures (int): commands that failed after their last attempt.
+    A policy shared by several controllers counts for all of them.
+    """
+    retryable = (NakError, ResponseTimeoutError, DesyncError)
+
+    def __init__(self, attempts=3, backoff=0.01, max_backoff=0.5, jitter=0.5, budgets=None, deadline=None,
+                 timeout=None, retry_timeouts=False):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.budgets = dict(budgets) if budgets else {}
+        self.deadline = deadline
+        self.timeout = timeout
+        self.retry_timeouts = retry_timeouts
+        self.retries = 0
+        self.failures = 0
+
+    def delay(self, retry):
+        """
+        Delay in seconds before retry number retry (1 for the first retry).
+        """
+        delay = min(self.max_backoff, self.backoff*2**(retry - 1))
+        return delay*(1.0 - self.jitter*random.random())
+
+    def run(self, mnemonic, operation, args=(), recover=None):
+        """
+        Call operation(*args) until it succeeds or the budget of mnemonic is spent,
+        then raise the last error. recover(error) is called before every retry.
+        """
+        attempts = self.budgets.get(mnemonic, self.attempts)
+        start = time.monotonic()
+        retry = 0
+        while True:
+            try:
+                return operation(*args)
+            except self.retryable as error:
+                retry += 1
+                delay = self.delay(retry)
+                if (retry >= attempts
+                        or (isinstance(error, ResponseTimeoutError) and not self.retry_timeouts)
+                        or (self.deadline is not None and time.monotonic() - start + delay > self.deadline)):
+                    self.failures += 1
+                    raise
+                self.retries += 1
+                if recover is not None:
+                    recover(error)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+def no_retry():
+    """
+    New RetryPolicy making a single attempt, errors are raised straight away.
+    """
+    return RetryPolicy(attempts=1)
+
+
+class _NoStage():
+    """
+    Context manager doing nothing, stands in for a profiling stage when no
+    profiler is attached (see profiling.Profiler).
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_STAGE = _NoStage()
+
+
+class _FdReader():
+    """
+    readinto straight from the non-blocking file descriptor of a local serial
+    port, used by the fast read path instead of serial.Serial.readinto. The bytes
+    land in the caller's buffer without the intermediate bytes object created by
+    pyserial, and everything that has arrived is returned instead of waiting
+    for the whole buffer.
+    """
+    __slots__ = ("port", "raw", "poller")
+
+    def __init__(self, port):
+        fd = port.fileno()
+        self.port = port
+        self.raw = io.FileIO(fd, "r", closefd=False)
+        self.poller = select.poll()
+        self.poller.register(fd, select.POLLIN)
+
+    @classmethod
+    def supports(cls, port):
+        """
+        True if port exposes a non-blocking file descriptor (serial.Serial on POSIX).
+        """
+        if not hasattr(select, "poll") or not hasattr(port, "fileno"):
+            return False
+        try:
+            return not os.get_blocking(port.fileno())
+        except (AttributeError, OSError, ValueError):
+            return False
+
+    def readinto(self, buffer):
+        """
+        Read what is waiting into buffer, waiting at most port.timeout seconds
+        for the first byte. Returns the number of bytes read, 0 on timeout.
+        """
+        # None (EAGAIN) or 0 (tty without VMIN) while nothing is waiting
+        n = self.raw.readinto(buffer)
+        if n:
+            return n
+        timeout = self.port.timeout
+        if not self.poller.poll(None if timeout is None else 1000.0*timeout):
+            return 0
+        n = self.raw.readinto(buffer)
+        if not n:
+            raise serial.SerialException("device reports readiness to read but returned no data (device disconnected?)")
+        return n
+
+
 class Controller():
 
-    def __init__(self):
+    def __init__(self, retry_policy=None):
         self.is_connected = False
         self.serial_port = None
         self.baudrate = None
+        self.parity = None
+        self.stopbits = None
+        self.timeout = None
+        self.serial_com = None
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        # profiling.Profiler timing the protocol stages, None to disable
+        self.profiler = None
+        # fast read path state: a line is always kept at the start of the buffer,
+        # bytes past the line terminator are carried over to the next read
+        self._buffer = bytearray(BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._buffer_fill = 0
+        # direct file descriptor reads of a local serial port, None for other transports
+        self._reader = None
+
+    def connect(self, serial_port, baudrate=9600, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_TWO, timeout=1):
+        """
+        Open the connection to the controller.
 
-    def connect(self, serial_port, baudrate, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_TWO):
+        Parameters:
+        serial_port (str): local serial device (e.g. "/dev/ttyUSB0"), "socket://host:port"
+                           for a raw TCP terminal server, "rfc2217://host:port" or
+                           "replay://path?speed=N" to replay a recorded log.
+        baudrate (int): 9600 (default), 19200 or 38400.
+        timeout (float): seconds to wait for an answer before ResponseTimeoutError.
+        """
         self.serial_port = serial_port
         self.baudrate = baudrate
+        self.parity = parity
+        self.stopbits = stopbits
+        self.timeout = timeout
         try:
-            self.serial_com = serial.Serial(port=serial_port, baudrate=baudrate, timeout=1, parity=parity, stopbits=stopbits)
+            if "://" in serial_port:
+                # network transports are only imported when used
+                import transports
+                self.serial_com = transports.open_transport(serial_port, baudrate=baudrate, parity=parity, stopbits=stopbits, timeout=timeout)
+            else:
+                self.serial_com = serial.Serial(port=serial_port, baudrate=baudrate, timeout=timeout, parity=parity, stopbits=stopbits)
+            self._apply_timeout()
             self.is_connected = True
-        except serial.SerialException:
+        except (serial.SerialException, OSError):
             print("Could not open serial port")
             self.is_connected = False
             pass
 
+    def connect_transport(self, transport):
+        """
+        Use an already open transport, any object implementing the serial.Serial
+        methods used by Controller (write, readline, readinto, in_waiting,
+        reset_input_buffer).
+        """
+        self.serial_com = transport
+        self._buffer_fill = 0
+        self._apply_timeout()
+        self.is_connected = True
+
+    def _apply_timeout(self):
+        """
+        Set the per-attempt timeout of the retry policy on the connection and
+        pick the reader of the fast read path.
+        """
+        if self.retry_policy.timeout is not None:
+            self.serial_com.timeout = self.retry_policy.timeout
+        self._reader = _FdReader(self.serial_com) if _FdReader.supports(self.serial_com) else None
+
+    def reconnect(self):
+        """
+        Close and reopen the connection with the last used settings. Connections
+        to TCP terminal servers are taken back from the pool when still alive.
+        """
+        if self.serial_com is not None:
+            self.close()
+        self.connect(self.serial_port, self.baudrate, self.parity, self.stopbits, self.timeout)
+
     def close(self):
         self.serial_com.close()
+        self._buffer_fill = 0
         self.is_connected = False
-    
+
+    def _stage(self, name):
+        if self.profiler is None:
+            return NO_STAGE
+        return self.profiler.stage(name)
+
     def send_command(self, command):
-        return self.serial_com.write(command+CR+LF)
-    
+        with self._stage("command write"):
+            return self.serial_com.write(command+CR+LF)
+
     def enquiry(self):
-        self.serial_com.write(ENQ)
-        return self.serial_com.readline().rstrip().decode()
-    
+        with self._stage("ENQ response"):
+            self.serial_com.write(ENQ)
+            response = self.serial_com.readline()
+        if not response:
+            raise ResponseTimeoutError(TIMEOUT_ERROR)
+        try:
+            return response.rstrip().decode()
+        except UnicodeDecodeError as error:
+            # line noise or a baudrate mismatch
+            raise DesyncError("{}: {!r}".format(DESYNC_ERROR, response)) from error
+
     def read_line(self):
         return self.serial_com.readline()
-    
+
     def read_acknowledgement(self):
         return self.serial_com.readline().rstrip()
 
+    def check_acknowledgement(self):
+        """
+        Read the answer to a command, raise if it is not ACK.
+        """
+        with self._stage("ACK wait"):
+            acknowledgement = self.read_acknowledgement()
+        if acknowledgement == ACK:
+            return
+        if acknowledgement == NAK:
+            raise NakError(ACK_ERROR)
+        if not acknowledgement:
+            raise ResponseTimeoutError(TIMEOUT_ERROR)
+        raise DesyncError("{}: {!r} instead of ACK".format(DESYNC_ERROR, acknowledgement))
+
+    def _transaction(self, command, parse=None):
+        """
+        Single attempt of a command: send it, check the acknowledgement, send ENQ
+        and return the response, passed through parse if given.
+        """
+        try:
+            self.send_command(command)
+            self.check_acknowledgement()
+            response = self.enquiry()
+        except CenterTwoError:
+            # ResponseTimeoutError is an OSError too
+            raise
+        except OSError as error:
+            raise TransportError("{}: {}".format(TRANSPORT_ERROR, error)) from error
+        if parse is None:
+            return response
+        try:
+            with self._stage("parse"):
+                return parse(response)
+        except (ValueError, IndexError) as error:
+            raise DesyncError("{}: {!r}".format(DESYNC_ERROR, response)) from error
+
+    def query(self, command, parse=None):
+        """
+        Send command and return its response, passed through parse if given,
+        retrying according to retry_policy.
+
+        Parameters:
+        command (bytes): command without the CR LF terminator, e.g. b"PRX".
+        parse (callable): converts the decoded response string.
+        """
+        return self.retry_policy.run(command[:3].decode(), self._transaction, (command, parse), self.recover)
+
+    def recover(self, error):
+        """
+        Bring the link back to a known state after error, before a retry.
+
+        The input buffer is flushed; after a NAK the ERR status is read and a
+        DeviceError raised if the controller reports an error, after a desync
+        the controller serial interface is reset (RES).
+        """
+        self._buffer_fill = 0
+        try:
+            self.serial_com.reset_input_buffer()
+            if isinstance(error, NakError):
+                status = self._transaction(b"ERR", parse_error_status)
+            elif isinstance(error, DesyncError):
+                self._transaction(b"RES,1")
+                self._buffer_fill = 0
+                self.serial_com.reset_input_buffer()
+                return
+            else:
+                return
+        except RetryPolicy.retryable:
+            # the retry will tell whether the link is still broken
+            return
+        except OSError as transport_error:
+            # reset_input_buffer of a closed connection
+            raise TransportError("{}: {}".format(TRANSPORT_ERROR, transport_error)) from transport_error
+        errors = decode_error_status(status)
+        if NO_ERR not in errors:
+            raise DeviceError(status, errors) from error
+
+    def _read_line_into(self):
+        """
+        Read a line into the preallocated receive buffer.
+
+        Local serial ports are read straight from their file descriptor, other
+        transports through their readinto. Returns the length of the line
+        without the CR LF terminator.
+        """
+        buffer = self._buffer
+        view = self._view
+        fill = self._buffer_fill
+        start = 0
+        while True:
+            eol = buffer.find(LF, start, fill)
+            if eol != -1:
+                break
+            start = fill
+            if fill == BUFFER_SIZE:
+                self._buffer_fill = 0
+                raise DesyncError("{}: line longer than {:d} bytes".format(DESYNC_ERROR, BUFFER_SIZE))
+            if self._reader is not None:
+                n = self._reader.readinto(view[fill:])
+            else:
+                # serial.Serial.readinto blocks until the buffer is full: read
+                # what is already waiting, or block for a single byte
+                chunk = min(max(self.serial_com.in_waiting, 1), BUFFER_SIZE - fill)
+                n = self.serial_com.readinto(view[fill:fill + chunk])
+            if not n:
+                self._buffer_fill = 0
+                raise ResponseTimeoutError(TIMEOUT_ERROR)
+            fill += n
+        # carry over what follows the terminator
+        rest = fill - eol - 1
+        end = eol
+        if end > 0 and buffer[end - 1] == CR[0]:
+            end -= 1
+        if rest:
+            view[:rest] = view[eol + 1:fill]
+        self._buffer_fill = rest
+        return end
+
+    def _parse_pressure_into(self, length, status_out, value_out, offset, count):
+        """
+        Parse "s,v[,s,v...]" pairs straight from the receive buffer, the values
+        are converted from memoryview slices without copying the bytes.
+
+        Statuses are written as integer indices of SENS_STATUS.
+        """
+        buffer = self._buffer
+        view = self._view
+        position = 0
+        for i in range(count):
+            comma = buffer.find(b",", position, length)
+            end = buffer.find(b",", comma + 1, length)
+            if end == -1:
+                end = length
+            # a single ASCII digit indexing SENS_STATUS
+            status = buffer[position] - 48
+            if comma != position + 1 or not 0 <= status < len(SENS_STATUS):
+                raise DesyncError("{}: {!r}".format(DESYNC_ERROR, bytes(buffer[:length])))
+            status_out[offset + i] = status
+            try:
+                value_out[offset + i] = float(view[comma + 1:end])
+            except ValueError as error:
+                raise DesyncError("{}: {!r}".format(DESYNC_ERROR, bytes(buffer[:length]))) from error
+            position = end + 1
+        return count
+
+    def _pressure_into(self, command, status_out, value_out, offset, count):
+        """
+        Single attempt of a fast path pressure reading.
+        """
+        try:
+            with self._stage("command write"):
+                self.serial_com.write(command)
+            with self._stage("ACK wait"):
+                length = self._read_line_into()
+            if length != 1 or self._buffer[0] != ACK[0]:
+                if length == 1 and self._buffer[0] == NAK[0]:
+                    raise NakError(ACK_ERROR)
+                raise DesyncError("{}: {!r} instead of ACK".format(DESYNC_ERROR, bytes(self._buffer[:length])))
+            with self._stage("ENQ response"):
+                self.serial_com.write(ENQ)
+                length = self._read_line_into()
+        except CenterTwoError:
+            raise
+        except OSError as error:
+            raise TransportError("{}: {}".format(TRANSPORT_ERROR, error)) from error
+        with self._stage("parse"):
+            return self._parse_pressure_into(length, status_out, value_out, offset, count)
+
     # AOM
     def set_analog_output(self, channel, curve):
         """
@@ -87,25 +653,19 @@ class Controller():
 
         Parameters:
         channel (int): 0 for channel 1, 1 for channel 2, 2 for channel 3.
-        curve (int): 0 for LoG, 1 for LoG A, 2 for LoG -6, 3 for LoG -3, 4 for LoG +0, 
+        curve (int): 0 for LoG, 1 for LoG A, 2 for LoG -6, 3 for LoG -3, 4 for LoG +0,
                      5 for LoG +3, 6 LoGC1, 7 for LoGC2, 8 for LoGC3, 9...22 for Lin -10...Lin +3,
                      23 for IM221, 24 for LoGC4, 25 for PM411.
         """
+        if channel not in (0, 1, 2) or curve not in range(26):
+            raise InvalidParameterError(INCORRECT_VALUE_ERROR)
         command = ("AOM,{:d},{:d}".format(channel, curve)).encode()
-        if self.read_acknowledgement() == ACK:
-            r_channel, r_curve = self.enquiry().split(",")
-            r_channel = int(r_channel)
-            r_curve = int(r_curve)
-            if r_channel == channel and r_curve == curve:
-                print("Analog output successfully set")
-                return [r_channel, r_curve]
-            else:
-                print(UNKNOWN_ERROR)
-                return -1
+        r_channel, r_curve = self.query(command, lambda r: [int(x) for x in r.split(",")])
+        if r_channel == channel and r_curve == curve:
+            print("Analog output successfully set")
+            return [r_channel, r_curve]
         else:
-            print(ACK_ERROR)
-            return -1
-            
+            raise VerificationError(UNKNOWN_ERROR)
 
     # BAU
     def set_baudrate(self, mode=0):
@@ -118,39 +678,47 @@ class Controller():
         if mode == 0 or mode == 1 or mode == 2:
             command = ("BAU,{:d}".format(mode)).encode()
         else:
-            print(INCORRECT_VALUE_ERROR)
-            return -1
-            
-        self.send_command(command)
-        if self.read_acknowledgement() == ACK:
-            r_mode = int(self.enquiry())
-            if r_mode == mode:
-                print("Baudrate succesfully set")
-                return r_mode
-            else:
-                print(UNKNOWN_ERROR)
-                return -1
+            raise InvalidParameterError(INCORRECT_VALUE_ERROR)
+
+        r_mode = self.query(command, int)
+        if r_mode == mode:
+            print("Baudrate succesfully set")
+            return r_mode
         else:
-            print(ACK_ERROR)
-            return -1
-            
+            raise VerificationError(UNKNOWN_ERROR)
+
     # COM
     def set_continuous_mode(self, period=1):
         """
-        TO DO
         Continuous mode. Continuous transmission of measurements to the serial interface.
+        The following measurements are read with read_continuous_pressure, sending any
+        other command ends the continuous mode.
 
         Parameters:
         period (int): 0 for 100 milliseconds, 1 for 1 second (default), 2 for 1 minute.
         """
-        command = ("COM,{:d}".format(period)).encode()
-        self.send_command(command)
-        if self.read_acknowledgement() == ACK:
-            s, v = self.enquiry().split(", ")
-            # TO DO
+        if period == 0 or period == 1 or period == 2:
+            command = ("COM,{:d}".format(period)).encode()
         else:
-            print(ACK_ERROR)
-            return -1
+            raise InvalidParameterError(INCORRECT_VALUE_ERROR)
+        return self.query(command, parse_pressure)
+
+    def read_continuous_pressure(self):
+        """
+        Next measurement of all transmitters sent in continuous mode, in the same
+        format as get_pressure. Raises ResponseTimeoutError if nothing arrives
+        within the timeout.
+        """
+        try:
+            line = self.serial_com.readline().rstrip()
+        except OSError as error:
+            raise TransportError("{}: {}".format(TRANSPORT_ERROR, error)) from error
+        if not line:
+            raise ResponseTimeoutError(TIMEOUT_ERROR)
+        try:
+            return parse_pressure(line.decode())
+        except (ValueError, IndexError) as error:
+            raise DesyncError("{}: {!r}".format(DESYNC_ERROR, line)) from error
 
     # CORR
     def set_correction_factor(self, cr1=1.0, cr2=1.0, cr3=1.0):
@@ -162,26 +730,11 @@ class Controller():
         cr2 (float): correction factor of channel 2, 0.10 to 9.99.
         cr3 (float): correction factor of channel 3, 0.10 to 9.99.
         """
-        if cr1 < 0.1 or cr1 > 9.99:
-            print(INCORRECT_VALUE_ERROR)
-            return -1
-        if cr2 < 0.1 or cr3 > 9.99:
-            print(INCORRECT_VALUE_ERROR)
-            return -1
-        if cr2 < 0.1 or cr3 > 9.99:
-            print(INCORRECT_VALUE_ERROR)
-            return -1
+        for cr in (cr1, cr2, cr3):
+            if cr < 0.1 or cr > 9.99:
+                raise InvalidParameterError(INCORRECT_VALUE_ERROR)
         command = ("COR,{:.2f},{:.2f},{:.2f}".format(cr1, cr2, cr3)).encode()
-        self.send_command(command)
-        if self.read_acknowledgement() == ACK:
-            r_cr1, r_cr2, r_cr3 = self.enquiry().split(",")
-            r_cr1 = float(r_cr1)
-            r_cr2 = float(r_cr2)
-            r_cr3 = float(r_cr3)
-            return [r_cr1, r_cr2, r_cr3]
-        else:
-            print(ACK_ERROR)
-            return -1
+        return self.query(command, lambda r: [float(x) for x in r.split(",")])
 
     # DCD
     def set_number_of_digits(self, digits=2):
@@ -193,22 +746,15 @@ class Controller():
         """
         if digits == 2 or digits == 3:
             command = ("DCD,{:d}".format(digits)).encode()
-            self.send_command(command)
         else:
-            print(INCORRECT_VALUE_ERROR)
-            return -1
-            
-        if self.read_acknowledgement() == ACK:
-            r_digits = int(self.enquiry())
-            if r_digits == digits:
-                print("Display digits succesfully set")
-                return r_digits
-            else:
-                print(UNKNOWN_ERROR)
-                return -1
+            raise InvalidParameterError(INCORRECT_VALUE_ERROR)
+
+        r_digits = self.query(command, int)
+        if r_digits == digits:
+            print("Display digits succesfully set")
+            return r_digits
         else:
-            print(ACK_ERROR)
-            return -1
+            raise VerificationError(UNKNOWN_ERROR)
 
     # DGS
 
@@ -222,25 +768,19 @@ class Controller():
         Parameters:
         None
         """
-        command = b"ERR"
-        self.send_command(command)
-        if self.read_acknowledgement() == ACK:
-            errors = []
-            status = self.enquiry()
-            if status[0] == '1':
-                errors.append(DEV_ERR)
-            if status[1] == '1':
-                errors.append(HW_ERR)
-            if status[2] == '1':
-                errors.append(INV_PAR)
-            if status[3] == '1':
-                errors.append(STX_ERR)
-            if status == '0000':
-                errors.append(NO_ERR)
-            return [status, errors]
-        else:
-            print(ACK_ERROR)
-            return -1
+        status = self.query(b"ERR", parse_error_status)
+        return [status, decode_error_status(status)]
+
+    def check_error_status(self):
+        """
+        Raise DeviceError if the controller reports an error in its ERR status.
+
+        Parameters:
+        None
+        """
+        status, errors = self.get_error_status()
+        if NO_ERR not in errors:
+            raise DeviceError(status, errors)
 
     # EUM
 
@@ -270,13 +810,7 @@ class Controller():
         Parameters:
         None
         """
-        command = b"PNR"
-        self.send_command(command)
-        if self.read_acknowledgement() == ACK:
-            return self.enquiry()
-        else:
-            print(ACK_ERROR)
-            return -1
+        return self.query(b"PNR")
 
     # PR#
     def get_channel_pressure(self, channel):
@@ -288,19 +822,27 @@ class Controller():
         """
         if channel == 1 or channel == 2 or channel == 3:
             command = ("PR{:d}".format(channel)).encode()
-            self.send_command(command)
         else:
-            print(INCORRECT_VALUE_ERROR)
-            return -1
-        if self.read_acknowledgement() == ACK:
-            s, v = self.enquiry().split(",")
-            s = int(s)
-            value = float(v)
-            status = SENS_STATUS[s]
-            return [status, value]
-        else:
-            print(ACK_ERROR)
-            return -1
+            raise InvalidParameterError(INCORRECT_VALUE_ERROR)
+        status, value = self.query(command, parse_pressure)
+        return [status[0], value[0]]
+
+    def get_channel_pressure_into(self, channel, status_out, value_out, offset=0):
+        """
+        Fast path of get_channel_pressure. Reads the response into a preallocated
+        buffer and writes the status index and the pressure into caller-supplied
+        arrays (NumPy arrays, array.array, lists) instead of building new lists.
+
+        Parameters:
+        channel (int): 1 for channel 1, 2 for channel 2, 3 for channel 3.
+        status_out: array receiving the index of the status in SENS_STATUS.
+        value_out: array receiving the pressure value.
+        offset (int): slot of status_out and value_out to write.
+        """
+        command = PR_COMMANDS.get(channel)
+        if command is None:
+            raise InvalidParameterError(INCORRECT_VALUE_ERROR)
+        return self.retry_policy.run(PR_MNEMONICS[channel], self._pressure_into, (command, status_out, value_out, offset, 1), self.recover)
 
     # PRE
     def set_pirani_pange_extention(self, re1=0, re2=0, re3=0):
@@ -314,25 +856,14 @@ class Controller():
         """
         if (re1 == 0 or re1 == 1) and (re2 == 0 or re2 == 1) and (re3 == 0 or re3 == 1):
             command = ("PRE,{:d},{:d},{:d}".format(re1, re2, re3)).encode()
-            self.send_command(command)
         else:
-            print(INCORRECT_VALUE_ERROR)
-            return -1
-        if self.read_acknowledgement() == ACK:
-            r_re1, r_2, r_re3 = self.enquiry().split(",")
-            r_re1 = int(r_re1)
-            r_re2 = int(r_re2)
-            r_re3 = int(r_re3)
-
-            if r_re1 == re1 and r_re2 == re2 and r_re3 == re3:
-                print("Pirani range extension successfully set")
-                return [re1, re2, re3]
-            else:
-                print(UNKNOWN_ERROR)
-                return -1
+            raise InvalidParameterError(INCORRECT_VALUE_ERROR)
+        r_re1, r_re2, r_re3 = self.query(command, lambda r: [int(x) for x in r.split(",")])
+        if r_re1 == re1 and r_re2 == re2 and r_re3 == re3:
+            print("Pirani range extension successfully set")
+            return [re1, re2, re3]
         else:
-            print(ACK_ERROR)
-            return -1
+            raise VerificationError(UNKNOWN_ERROR)
 
     # PRX
     def get_pressure(self):
@@ -342,19 +873,20 @@ class Controller():
         Parameters:
         None
         """
-        command = b"PRX"
-        self.send_command(command)
-        if self.read_acknowledgement() == ACK:
-            status = [[], [], []]
-            value = [[], [], []]
-            status[0], value[0], status[1], value[1], status[2], value[2] = self.enquiry().split(",")
-            for i, (s, v) in enumerate(zip(status, value)):
-                status[i] = SENS_STATUS[int(s)]
-                value[i] = float(v)
-            return [status, value]
-        else:
-            print(ACK_ERROR)
-            return -1
+        return self.query(b"PRX", parse_pressure)
+
+    def get_pressure_into(self, status_out, value_out, offset=0):
+        """
+        Fast path of get_pressure. Reads the response into a preallocated buffer
+        and writes the status indices and the pressures of the three transmitters
+        into caller-supplied arrays (NumPy arrays, array.array, lists).
+
+        Parameters:
+        status_out: array receiving the indices of the statuses in SENS_STATUS.
+        value_out: array receiving the pressure values.
+        offset (int): first of the three slots of status_out and value_out to write.
+        """
+        return self.retry_policy.run("PRX", self._pressure_into, (PRX_COMMAND, status_out, value_out, offset, 3), self.recover)
 
     # RES
     def reset_serial(self, rst=0):
@@ -366,25 +898,60 @@ class Controller():
         """
         if rst == 1:
             command = ("RES,{:d}".format(rst)).encode()
-            self.send_command(command)
-        else:
-            print("To perform a reset the rst parameter must be 1")
-            return -1
-        if self.read_acknowledgement() == ACK:
-            quequed_errors = self.enquiry().split(",")
-            quequed_errors = [int(x) for x in quequed_errors]
-            return [QUEUED_ERROR[x] for x in quequed_errors]
         else:
-            print(ACK_ERROR)
-            return -1
+            raise InvalidParameterError("To perform a reset the rst parameter must be 1")
+        quequed_errors = self.query(command, lambda r: [int(x) for x in r.split(",")])
+        return [QUEUED_ERROR[x] for x in quequed_errors]
 
     # SAV
 
     # SC#
 
     # SP#
+    def set_setpoint(self, setpoint, channel, lower, upper):
+        """
+        Switching function. The relay switches on when the pressure falls below the
+        lower threshold and off when it rises above the upper threshold.
+
+        Parameters:
+        setpoint (int): switching function, 1 to 4.
+        channel (int): 0 for channel 1, 1 for channel 2, 2 for channel 3.
+        lower (float): lower threshold.
+        upper (float): upper threshold, not below the lower threshold.
+        """
+        if setpoint in range(1, SETPOINTS + 1) and channel in (0, 1, 2) and 0 < lower <= upper:
+            command = ("SP{:d},{:d},{:.4E},{:.4E}".format(setpoint, channel, lower, upper)).encode()
+        else:
+            raise InvalidParameterError(INCORRECT_VALUE_ERROR)
+        r_channel, r_lower, r_upper = self.query(command, parse_setpoint)
+        if r_channel == channel:
+            print("Switching function successfully set")
+            return [r_channel, r_lower, r_upper]
+        else:
+            raise VerificationError(UNKNOWN_ERROR)
+
+    def get_setpoint(self, setpoint):
+        """
+        Switching function settings as [channel, lower threshold, upper threshold].
+
+        Parameters:
+        setpoint (int): switching function, 1 to 4.
+        """
+        if setpoint in range(1, SETPOINTS + 1):
+            command = ("SP{:d}".format(setpoint)).encode()
+        else:
+            raise InvalidParameterError(INCORRECT_VALUE_ERROR)
+        return self.query(command, parse_setpoint)
 
     # SPS
+    def get_setpoint_status(self):
+        """
+        Switching functions status, one int per switching function: 0 for off, 1 for on.
+
+        Parameters:
+        None
+        """
+        return self.query(b"SPS", lambda r: [int(x) for x in r.split(",")])
 
     # TAD
 
@@ -393,7 +960,7 @@ class Controller():
     # TEE
 
     # TEP
-    
+
     # TID
     def get_transmitter_id(self):
         """
@@ -402,13 +969,7 @@ class Controller():
         Parameters:
         None
         """
-        command = b"TID"
-        self.send_command(command)
-        if self.read_acknowledgement() == ACK:
-            return self.enquiry().split(",")
-        else:
-            print(ACK_ERROR)
-            return -1
+        return self.query(b"TID", lambda r: r.split(","))
 
     # TIO
 
@@ -421,6 +982,67 @@ class Controller():
     # TRS
 
     # UNI
+    def set_pressure_unit(self, unit=0):
+        """
+        Unit of measurement of the pressure readings.
+
+        Parameters:
+        unit (int): 0 for mbar (default), 1 for Torr, 2 for Pascal, 3 for Micron.
+        """
+        if unit in range(len(PRESSURE_UNITS)):
+            command = ("UNI,{:d}".format(unit)).encode()
+        else:
+            raise InvalidParameterError(INCORRECT_VALUE_ERROR)
+        r_unit = self.query(command, int)
+        if r_unit == unit:
+            print("Pressure unit successfully set")
+            return r_unit
+        else:
+            raise VerificationError(UNKNOWN_ERROR)
+
+    def get_pressure_unit(self):
+        """
+        Unit of measurement of the pressure readings, index of PRESSURE_UNITS.
+
+        Parameters:
+        None
+        """
+        return self.query(b"UNI", int)
 
     # WDT
-    
\ No newline at end of file
+
+
+def main(argv=None):
+    """
+    One-shot command line reads, e.g. "python CenterTwo.py /dev/ttyUSB0 pressure".
+    """
+    import argparse
+    readings = {"pressure": Controller.get_pressure,
+                "tid": Controller.get_transmitter_id,
+                "pnr": Controller.get_program_number,
+                "err": Controller.get_error_status,
+                "unit": Controller.get_pressure_unit}
+    parser = argparse.ArgumentParser(description="Read a CENTER TWO controller once.")
+    parser.add_argument("port", help="serial device, socket://host:port or rfc2217://host:port")
+    parser.add_argument("reading", choices=sorted(readings))
+    parser.add_argument("--baudrate", type=int, default=9600)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    controller = Controller()
+    controller.connect(args.port, args.baudrate, timeout=args.timeout)
+    if not controller.is_connected:
+        return 1
+    try:
+        result = readings[args.reading](controller)
+    except CenterTwoError as error:
+        print("{}: {}".format(type(error).__name__, error))
+        return 1
+    finally:
+        controller.close()
+    print(result)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
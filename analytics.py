@@ -0,0 +1,283 @@
+"""
+Pump-down and leak-rate analytics over the pressure archive.
+
+Every channel of a log is split into segments from the smoothed slope of
+log10(pressure):
+
+vent       fast rise (above vent_rate decades/s)
+pump-down  fall (below -pump_rate decades/s)
+rise       slow rise, a rate-of-rise leak test with the pump valved off
+steady     anything in between
+
+Segments never span an acquisition gap longer than gap_factor sample periods.
+A slope in decades/s depends on the base pressure, so a steady segment whose
+linear dp/dt is significantly positive and raises the pressure by at least
+min_rise of its mean is also labelled rise. Every segment is fitted at once
+with per-segment sums, without a Python loop over samples:
+
+pump-down  time constant tau of ln(p) = a - t/tau and exponent n of p ~ t^-n
+rise       dp/dt from p = a + dp/dt*t, leak rate = volume*dp/dt
+steady     mean, standard deviation and dp/dt of the pressure
+
+Usage: python analytics.py logs/*.dat [--time-scale 3600] [--volume 10] [-j 8]
+"""
+import argparse
+import csv
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import processing
+import replay
+
+VENT = "vent"
+PUMP_DOWN = "pump-down"
+RISE = "rise"
+STEADY = "steady"
+KINDS = np.array([STEADY, PUMP_DOWN, RISE, VENT])
+
+FIELDS = ["file", "channel", "kind", "start", "end", "samples", "p_start", "p_end",
+          "p_mean", "p_std", "tau", "exponent", "dpdt", "leak_rate"]
+
+
+def moving_average(values, window):
+    """
+    Centred moving average, shrinking the window at the edges.
+    """
+    window = max(1, min(window, len(values)))
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    half = window//2
+    index = np.arange(len(values))
+    lower = np.clip(index - half, 0, len(values))
+    upper = np.clip(index - half + window, 0, len(values))
+    return (cumulative[upper] - cumulative[lower])/(upper - lower)
+
+
+def local_slopes(times, values, window):
+    """
+    Least squares slope of values against times over the window samples around
+    every sample. At the edges the window is shifted inside the data instead of
+    shrunk, a shrunk window would bias the slope of the first and last samples.
+    """
+    window = max(2, min(window, len(values)))
+    t = sliding_window_view(times, window)
+    y = sliding_window_view(values, window)
+    t = t - t.mean(axis=1, keepdims=True)
+    slopes = (t*(y - y.mean(axis=1, keepdims=True))).sum(axis=1)/(t*t).sum(axis=1)
+    first = np.clip(np.arange(len(values)) - window//2, 0, len(values) - window)
+    return slopes[first]
+
+
+def classify(times, pressure, window=5, pump_rate=1e-4, vent_rate=1e-2):
+    """
+    Label every sample with an index of KINDS from the smoothed slope of
+    log10(pressure) in decades per second.
+    """
+    if len(times) < 2:
+        return np.zeros(len(times), dtype=np.int8)
+    slope = local_slopes(times, np.log10(pressure), window)
+    slope = moving_average(slope, window)
+    labels = np.zeros(len(times), dtype=np.int8)
+    labels[slope < -pump_rate] = 1
+    labels[slope > pump_rate] = 2
+    labels[slope > vent_rate] = 3
+    return labels
+
+
+def gap_breaks(times, gap_factor=5.0):
+    """
+    Indices of the samples following a time step longer than gap_factor times
+    the median sample period.
+    """
+    if len(times) < 2:
+        return np.zeros(0, dtype=int)
+    steps = np.diff(times)
+    return np.flatnonzero(steps > gap_factor*np.median(steps)) + 1
+
+
+def segment(labels, min_samples=5, breaks=()):
+    """
+    Boundaries of the runs of equal labels as (starts, ends, labels) arrays,
+    ends exclusive. Runs shorter than min_samples are merged into the previous
+    run, except across breaks: indices at which a new run always starts.
+    """
+    breaks = np.asarray(breaks, dtype=int)
+    change = np.union1d(np.flatnonzero(np.diff(labels)) + 1, breaks)
+    starts = np.concatenate(([0], change)).astype(int)
+    ends = np.concatenate((change, [len(labels)])).astype(int)
+    kinds = labels[starts]
+    forced = np.isin(starts, breaks)
+    forced[0] = True
+    keep = ((ends - starts) >= min_samples) | forced
+    # a dropped run extends the kept run before it
+    starts = starts[keep]
+    kinds = kinds[keep]
+    forced = forced[keep]
+    # merging may have made neighbouring runs equal
+    same = np.concatenate(([False], kinds[1:] == kinds[:-1])) & ~forced
+    starts = starts[~same]
+    ends = np.concatenate((starts[1:], [len(labels)]))
+    return starts, ends, kinds[~same]
+
+
+def segment_sums(x, y, starts, ends):
+    """
+    Per-segment n, sum x, sum y, sum x^2, sum xy. Segments are contiguous,
+    every one is summed on its own with reduceat to keep the precision when the
+    pressure spans many decades.
+    """
+    def sums(values):
+        return np.add.reduceat(values, starts)
+    return (ends - starts).astype(float), sums(x), sums(y), sums(x*x), sums(x*y)
+
+
+def linear_fits(x, y, starts, ends):
+    """
+    Least squares slope and intercept of y = a + b*x on every segment at once.
+    """
+    n, sx, sy, sxx, sxy = segment_sums(x, y, starts, ends)
+    denominator = n*sxx - sx*sx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(denominator > 0, (n*sxy - sx*sy)/denominator, np.nan)
+    intercept = (sy - slope*sx)/n
+    return slope, intercept
+
+
+def slope_errors(x, y, starts, ends, slope, intercept):
+    """
+    Standard errors of the slopes returned by linear_fits, NaN for segments of
+    fewer than 3 samples.
+    """
+    counts = ends - starts
+    residual = y - np.repeat(intercept, counts) - np.repeat(slope, counts)*x
+    spread = x - np.repeat(np.add.reduceat(x, starts)/counts, counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = np.add.reduceat(residual*residual, starts)/(counts - 2)/np.add.reduceat(spread*spread, starts)
+    return np.where(counts > 2, np.sqrt(variance), np.nan)
+
+
+def analyse_channel(times, pressure, volume=None, window=5, min_samples=5, pump_rate=1e-4, vent_rate=1e-2,
+                    gap_factor=5.0, rise_significance=5.0, min_rise=0.05):
+    """
+    Segment one channel and fit every segment.
+
+    Parameters:
+    times (array): times in seconds.
+    pressure (array): valid pressures, NaN samples must be removed beforehand.
+    volume (float): volume of the chamber in litres, gives the leak rate of
+                    rise segments in pressure unit*l/s.
+    gap_factor (float): time steps longer than gap_factor median sample periods
+                        end a segment.
+    rise_significance (float): standard errors of its dp/dt a steady segment
+                               needs to be labelled rise.
+    min_rise (float): pressure increase over a steady segment, as a fraction of
+                      its mean, needed to label it rise.
+
+    Returns a dict of arrays, one entry per segment, with the FIELDS keys
+    except file and channel.
+    """
+    breaks = gap_breaks(times, gap_factor)
+    bounds = np.concatenate(([0], breaks, [len(times)]))
+    # no smoothing across the gaps
+    labels = np.concatenate([classify(times[a:b], pressure[a:b], window, pump_rate, vent_rate)
+                             for a, b in zip(bounds[:-1], bounds[1:])])
+    starts, ends, kinds = segment(labels, min_samples, breaks)
+    last = ends - 1
+    counts = ends - starts
+    n = counts.astype(float)
+    p_mean = np.add.reduceat(pressure, starts)/n
+    deviation = pressure - np.repeat(p_mean, counts)
+    p_std = np.sqrt(np.add.reduceat(deviation*deviation, starts)/n)
+
+    # times since the segment start keep the sums small with epoch timestamps
+    elapsed = times - np.repeat(times[starts], counts)
+    spacing = np.median(np.diff(times)) if len(times) > 1 else 1.0
+    # ln(p) against time, and log(p) against log(time since the segment start)
+    ln_slope, _ = linear_fits(elapsed, np.log(pressure), starts, ends)
+    power_slope, _ = linear_fits(np.log(elapsed + spacing), np.log(pressure), starts, ends)
+    dpdt, intercept = linear_fits(elapsed, pressure, starts, ends)
+    dpdt_error = slope_errors(elapsed, pressure, starts, ends, dpdt, intercept)
+
+    with np.errstate(invalid="ignore"):
+        leak = ((kinds == 0) & (dpdt > rise_significance*dpdt_error)
+                & (dpdt*(times[last] - times[starts]) >= min_rise*p_mean))
+    kinds = np.where(leak, 2, kinds)
+    pump = kinds == 1
+    rise = kinds == 2
+    with np.errstate(divide="ignore"):
+        tau = np.where(pump, -1.0/ln_slope, np.nan)
+    exponent = np.where(pump, -power_slope, np.nan)
+    dpdt = np.where(rise | (kinds == 0), dpdt, np.nan)
+    leak_rate = np.where(rise, dpdt*volume, np.nan) if volume is not None else np.full(len(kinds), np.nan)
+    return {"kind": KINDS[kinds], "start": times[starts], "end": times[last], "samples": counts,
+            "p_start": pressure[starts], "p_end": pressure[last], "p_mean": p_mean, "p_std": p_std,
+            "tau": tau, "exponent": exponent, "dpdt": dpdt, "leak_rate": leak_rate}
+
+
+def analyse_log(path, time_scale=3600.0, volume=None, **kwargs):
+    """
+    Analyse every channel of a log (see replay.load_log). Readings whose status
+    is not "Measurement data ok" are left out.
+
+    Returns a list of per-segment summary dicts with the FIELDS keys.
+    """
+    times, pressure, status = replay.load_log(path, time_scale)
+    pressure, _ = processing.mask_invalid(pressure, status)
+    summaries = []
+    for channel in range(pressure.shape[1]):
+        valid = np.isfinite(pressure[:, channel]) & (pressure[:, channel] > 0)
+        if valid.sum() < 2:
+            continue
+        result = analyse_channel(times[valid], pressure[valid, channel], volume, **kwargs)
+        for i in range(len(result["kind"])):
+            summary = {"file": str(path), "channel": channel + 1}
+            summary.update({key: values[i].item() for key, values in result.items()})
+            summaries.append(summary)
+    return summaries
+
+
+def _analyse_log(arguments):
+    path, time_scale, volume, kwargs = arguments
+    try:
+        return analyse_log(path, time_scale, volume, **kwargs)
+    except (ValueError, OSError) as error:
+        # a truncated or unreadable log must not lose the results of the others
+        print("Skipping {}: {}".format(path, error), file=sys.stderr)
+        return []
+
+
+def analyse_archive(paths, time_scale=3600.0, volume=None, processes=None, **kwargs):
+    """
+    Analyse many logs in parallel, one log per worker process. Logs that cannot
+    be read are reported on stderr and skipped.
+
+    Parameters:
+    paths (list): log files.
+    processes (int): worker processes, all the cores if None, 1 to stay in process.
+    """
+    jobs = [(path, time_scale, volume, kwargs) for path in paths]
+    if processes == 1:
+        results = map(_analyse_log, jobs)
+        return [summary for result in results for summary in result]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = executor.map(_analyse_log, jobs, chunksize=max(1, len(jobs)//64))
+        return [summary for result in results for summary in result]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Segment and fit pump-downs and rate-of-rise tests in pressure logs.")
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--time-scale", type=float, default=3600.0, help="seconds per unit of the time column (3600 for plot_pressure.py logs)")
+    parser.add_argument("--volume", type=float, default=None, help="chamber volume in litres for the leak rate")
+    parser.add_argument("-j", "--processes", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    summaries = analyse_archive(args.logs, args.time_scale, args.volume, args.processes)
+    writer = csv.DictWriter(sys.stdout, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(summaries)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
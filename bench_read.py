@@ -0,0 +1,105 @@
+"""
+Memory benchmark of the pressure read paths based on tracemalloc.
+
+Usage: python bench_read.py [--reads N]
+
+A Controller reads canned answers from a pipe, whose non-blocking read end
+stands in for the file descriptor of a local serial port, so that only the
+allocations of the read path itself are measured. For get_pressure and for the
+fast path get_pressure_into the script reports the peak of short-lived memory
+during a read, the memory retained after all the reads and the number of
+garbage collections they triggered.
+"""
+import argparse
+import gc
+import os
+import tracemalloc
+import CenterTwo
+
+# answers of a CENTER TWO to PRX and ENQ
+ANSWERS = {CenterTwo.PRX_COMMAND: CenterTwo.ACK + CenterTwo.CR + CenterTwo.LF,
+           CenterTwo.ENQ: b"0,1.0000E-03,0,2.0000E-03,5,0.0000E+00" + CenterTwo.CR + CenterTwo.LF}
+
+
+class PipePort():
+    """
+    Stand-in for a local serial.Serial: commands are answered from ANSWERS
+    through a pipe.
+    """
+
+    def __init__(self, timeout=1):
+        self.timeout = timeout
+        self._read, self._write = os.pipe()
+        os.set_blocking(self._read, False)
+
+    def fileno(self):
+        return self._read
+
+    def write(self, data):
+        os.write(self._write, ANSWERS[data])
+        return len(data)
+
+    def readline(self):
+        # byte by byte like serial.Serial.readline
+        line = bytearray()
+        while not line.endswith(CenterTwo.LF):
+            try:
+                line += os.read(self._read, 1)
+            except BlockingIOError:
+                break
+        return bytes(line)
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        os.close(self._read)
+        os.close(self._write)
+
+
+def measure(read, reads):
+    """
+    Peak short-lived and retained bytes per read of read(), and garbage
+    collections during reads calls.
+    """
+    collections = []
+    callback = lambda phase, info: collections.append(info) if phase == "start" else None
+    read()
+    tracemalloc.start()
+    gc.callbacks.append(callback)
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        peak = 0
+        for _ in range(reads):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            read()
+            current, highest = tracemalloc.get_traced_memory()
+            peak = max(peak, highest - before)
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        gc.callbacks.remove(callback)
+        tracemalloc.stop()
+    return peak, retained/reads, len(collections)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the allocations of the CenterTwo pressure read paths.")
+    parser.add_argument("--reads", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    controller = CenterTwo.Controller(CenterTwo.no_retry())
+    controller.connect_transport(PipePort())
+    status = [0]*3
+    value = [0.0]*3
+    for name, read in (("get_pressure", controller.get_pressure),
+                       ("get_pressure_into", lambda: controller.get_pressure_into(status, value))):
+        peak, retained, collections = measure(read, args.reads)
+        print("{}: peak {:d} B per read, retained {:.2f} B per read, {:d} garbage collections in {:d} reads".format(
+            name, peak, retained, collections, args.reads))
+    controller.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,59 @@
+"""
+Startup benchmark based on "python -X importtime".
+
+Usage: python bench_startup.py [module ...] [--runs N]
+
+For every module (CenterTwo by default) the import is timed in fresh
+interpreters and the modules that should only be imported lazily are checked
+to be absent.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# modules a bare "import CenterTwo" must not pull in
+HEAVY_MODULES = ("numpy", "matplotlib", "socket", "transports", "analytics", "health", "monitor", "processing", "profiling", "quality", "replay", "simulator")
+
+
+def import_times(module):
+    """
+    Run "import module" in a fresh interpreter, return {module: cumulative us}.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=here + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            capture_output=True, text=True, env=env, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the import time of the CenterTwo modules.")
+    parser.add_argument("modules", nargs="*", default=["CenterTwo"])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in args.modules:
+        # the first run also compiles the bytecode, leave it out
+        import_times(module)
+        runs = [import_times(module) for _ in range(args.runs)]
+        totals = sorted(run[module] for run in runs)
+        print("{}: median {:.1f} ms, min {:.1f} ms over {:d} runs".format(
+            module, totals[len(totals)//2]/1000.0, totals[0]/1000.0, args.runs))
+        if module == "CenterTwo":
+            loaded = [m for m in HEAVY_MODULES if m in runs[0]]
+            if loaded:
+                print("  imported eagerly: " + ", ".join(loaded))
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
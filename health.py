@@ -0,0 +1,206 @@
+import time
+from collections import deque, namedtuple
+from CenterTwo import SENS_STATUS, NO_TRANSMITTER
+
+# transmitter identifications returned by TID for an empty channel
+NO_SENSOR_IDS = ("noSEn", "noid")
+
+# health class of every SENS_STATUS index
+OK = "ok"
+FAULTY = "faulty"
+OFF = "off"
+MISSING = "missing"
+STATUS_HEALTH = [OK,      # Measurement data ok
+                 OK,      # Measurement under range
+                 OK,      # Measurement over range
+                 FAULTY,  # Transmitter error
+                 OFF,     # Transmitter switched off
+                 MISSING, # No transmitter
+                 FAULTY,  # Identification error
+                 FAULTY]  # ITR error
+
+# kind is "status" or "hot-swap", old and new are status codes or transmitter ids
+HealthEvent = namedtuple("HealthEvent", ["timestamp", "controller", "channel", "kind", "old", "new"])
+
+
+class SensorState():
+    """
+    What is known about the sensor on one channel of one controller.
+    """
+
+    def __init__(self):
+        self.transmitter_id = None
+        # last id of an actual sensor, kept while the channel reports no sensor
+        self.installed_id = None
+        self.status = None
+        self.since = None
+        self.last_seen = None
+        self.samples = 0
+        self.errors = 0
+        self.hot_swaps = 0
+        self.transitions = deque()
+
+    @property
+    def health(self):
+        if self.status is None:
+            return None
+        return STATUS_HEALTH[self.status]
+
+
+class HealthTracker():
+    """
+    Tracks the sensors of many controllers from their status and TID streams.
+
+    Every observation updates the sensor state, the cached inventory and the
+    sets of faulty, missing, switched off and flapping sensors in place, so
+    fleet_health() and inventory() cost nothing but a copy. A sensor is
+    flapping when its status changed at least flap_threshold times within the
+    last flap_window seconds. A hot-swap is a sensor id differing from the
+    previous sensor id of the channel; a sensor dropping out or coming back
+    (TID reporting no sensor) is a status change, so an intermittent gauge
+    shows up as flapping.
+    """
+
+    def __init__(self, flap_window=600.0, flap_threshold=5, clock=time.time, max_events=10000):
+        self.flap_window = flap_window
+        self.flap_threshold = flap_threshold
+        self.clock = clock
+        self.sensors = {}
+        self.events = deque(maxlen=max_events)
+        self._inventory = {}
+        self._by_health = {FAULTY: set(), OFF: set(), MISSING: set()}
+        self._flapping = set()
+
+    def _sensor(self, key):
+        sensor = self.sensors.get(key)
+        if sensor is None:
+            sensor = self.sensors[key] = SensorState()
+        return sensor
+
+    def observe_status(self, controller, channel, status, timestamp=None):
+        """
+        Record the status of a reading.
+
+        Parameters:
+        controller (str): name of the controller.
+        channel (int): 1 to 3.
+        status (int or str): SENS_STATUS index or string.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        if isinstance(status, str):
+            status = SENS_STATUS.index(status)
+        key = (controller, channel)
+        sensor = self._sensor(key)
+        sensor.samples += 1
+        sensor.last_seen = timestamp
+        if STATUS_HEALTH[status] == FAULTY:
+            sensor.errors += 1
+        return self._set_status(key, sensor, status, timestamp)
+
+    def _set_status(self, key, sensor, status, timestamp):
+        if status == sensor.status:
+            return None
+        old = sensor.status
+        if old is not None:
+            self._by_health.get(STATUS_HEALTH[old], set()).discard(key)
+        self._by_health.get(STATUS_HEALTH[status], set()).add(key)
+        sensor.status = status
+        sensor.since = timestamp
+        if old is None:
+            return None
+
+        sensor.transitions.append(timestamp)
+        self._update_flapping(key, sensor, timestamp)
+        event = HealthEvent(timestamp, key[0], key[1], "status", old, status)
+        self.events.append(event)
+        return event
+
+    def observe_pressure(self, controller, reading, timestamp=None):
+        """
+        Record the statuses of a Controller.get_pressure reading ([status, value] lists).
+        """
+        status, _ = reading
+        events = [self.observe_status(controller, channel + 1, s, timestamp) for channel, s in enumerate(status)]
+        return [event for event in events if event is not None]
+
+    def observe_ids(self, controller, ids, timestamp=None):
+        """
+        Record a Controller.get_transmitter_id reading, one id per channel.
+        A sensor id differing from the previous one of the channel is reported
+        as a hot-swap, a channel reporting no sensor as status "No transmitter".
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        events = []
+        for channel, transmitter_id in enumerate(ids, 1):
+            key = (controller, channel)
+            sensor = self._sensor(key)
+            if transmitter_id == sensor.transmitter_id:
+                continue
+            sensor.transmitter_id = transmitter_id
+            if transmitter_id in NO_SENSOR_IDS:
+                self._inventory.pop(key, None)
+                event = self._set_status(key, sensor, NO_TRANSMITTER, timestamp)
+                if event is not None:
+                    events.append(event)
+                continue
+            self._inventory[key] = transmitter_id
+            old = sensor.installed_id
+            sensor.installed_id = transmitter_id
+            if old is not None and old != transmitter_id:
+                sensor.hot_swaps += 1
+                # a new sensor starts with a clean history
+                sensor.transitions.clear()
+                self._flapping.discard(key)
+                event = HealthEvent(timestamp, controller, channel, "hot-swap", old, transmitter_id)
+                self.events.append(event)
+                events.append(event)
+        return events
+
+    def poll(self, name, controller):
+        """
+        Read transmitter ids and statuses of a Controller and record them.
+        Returns the events.
+        """
+        timestamp = self.clock()
+        events = self.observe_ids(name, controller.get_transmitter_id(), timestamp)
+        return events + self.observe_pressure(name, controller.get_pressure(), timestamp)
+
+    def _update_flapping(self, key, sensor, now):
+        transitions = sensor.transitions
+        while transitions and transitions[0] < now - self.flap_window:
+            transitions.popleft()
+        if len(transitions) >= self.flap_threshold:
+            self._flapping.add(key)
+        else:
+            self._flapping.discard(key)
+
+    def is_flapping(self, controller, channel, now=None):
+        key = (controller, channel)
+        if key not in self._flapping:
+            return False
+        self._update_flapping(key, self.sensors[key], self.clock() if now is None else now)
+        return key in self._flapping
+
+    def inventory(self):
+        """
+        Transmitter id of every channel with a sensor, keyed by (controller, channel).
+        """
+        return dict(self._inventory)
+
+    def fleet_health(self, now=None):
+        """
+        Fleet-wide summary: number of sensors and the (controller, channel) keys
+        of the faulty, switched off, missing and flapping ones.
+        """
+        now = self.clock() if now is None else now
+        for key in list(self._flapping):
+            self._update_flapping(key, self.sensors[key], now)
+        unhealthy = set().union(*self._by_health.values(), self._flapping)
+        return {"sensors": len(self.sensors),
+                "healthy": len(self.sensors) - len(unhealthy),
+                "faulty": sorted(self._by_health[FAULTY]),
+                "off": sorted(self._by_health[OFF]),
+                "missing": sorted(self._by_health[MISSING]),
+                "flapping": sorted(self._flapping)}
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import namedtuple
+from CenterTwo import CenterTwoError
+
+# a relay change: setpoint (1 to 4), new state (0 off, 1 on), time at which the
+# read of the new state was sent, window in which the change happened (time since
+# the previous read), serial round-trip of the read and latency from the read to
+# the return of the callback (None while the callback runs)
+SetpointEvent = namedtuple("SetpointEvent", ["timestamp", "setpoint", "state", "window", "round_trip", "latency"])
+
+
+class SetpointMonitor():
+    """
+    Watches the switching functions of a Controller and emits a SetpointEvent
+    only when a relay changes state.
+
+    poll() reads SPS (a few bytes per cycle); when a loop already talks to the
+    controller, call update() with the states read there instead. For every
+    event the latency from sending the read to the return of the callback is
+    measured, the serial round-trip of the read separately; the relay change
+    itself happened at most event.window seconds before the read.
+    """
+
+    def __init__(self, controller=None, callback=None, clock=time.monotonic):
+        self.controller = controller
+        self.callback = callback
+        self.clock = clock
+        self.states = None
+        self.last_update = None
+        self.events = []
+        self.errors = 0
+        self.max_events = 10000
+        self._latencies = []
+        self._windows = []
+        self._round_trips = []
+
+    def poll(self):
+        """
+        Read the switching functions status and emit the changes.
+        Returns the list of events, errors of the read are raised.
+        """
+        sent = self.clock()
+        states = self.controller.get_setpoint_status()
+        return self.update(states, sent, self.clock() - sent)
+
+    def update(self, states, timestamp=None, round_trip=None):
+        """
+        Compare states with the previous ones and emit the changes.
+
+        Parameters:
+        states (list): one int per switching function, 0 for off, 1 for on.
+        timestamp (float): time at which the read of states was sent, by default now.
+        round_trip (float): duration of the read in seconds, if known.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        previous = self.states
+        window = None if self.last_update is None else timestamp - self.last_update
+        self.states = list(states)
+        self.last_update = timestamp
+        if previous is None:
+            return []
+
+        events = []
+        for i, (old, new) in enumerate(zip(previous, states)):
+            if old == new:
+                continue
+            event = SetpointEvent(timestamp, i + 1, new, window, round_trip, None)
+            if self.callback is not None:
+                self.callback(event)
+            latency = self.clock() - timestamp
+            events.append(event._replace(latency=latency))
+            self._latencies.append(latency)
+            self._windows.append(window)
+            self._round_trips.append(round_trip)
+        if events:
+            self.events.extend(events)
+            del self.events[:-self.max_events]
+            del self._latencies[:-self.max_events]
+            del self._windows[:-self.max_events]
+            del self._round_trips[:-self.max_events]
+        return events
+
+    def run(self, period=0.1, stop=None):
+        """
+        Poll every period seconds until the stop threading.Event is set. Failed
+        reads are counted in errors and skipped.
+        """
+        if stop is None:
+            stop = threading.Event()
+        next_poll = self.clock()
+        while not stop.is_set():
+            try:
+                self.poll()
+            except CenterTwoError:
+                self.errors += 1
+            next_poll += period
+            stop.wait(max(0.0, next_poll - self.clock()))
+
+    def start(self, period=0.1):
+        """
+        Run the monitor in a background thread. Returns the stop threading.Event.
+        """
+        stop = threading.Event()
+        thread = threading.Thread(target=self.run, args=(period, stop), daemon=True)
+        thread.start()
+        return stop
+
+    def latency_report(self):
+        """
+        Statistics in seconds over the recorded events of the latency from
+        sending the read to the return of the callback, of the serial round-trip
+        of the read and of the window in which the relay changes happened (upper
+        bound of the detection delay on top of the latency).
+        """
+        report = {"events": len(self._latencies)}
+        for name, values in (("latency", self._latencies),
+                             ("round_trip", [r for r in self._round_trips if r is not None]),
+                             ("window", [w for w in self._windows if w is not None])):
+            if not values:
+                continue
+            ordered = sorted(values)
+            report[name] = {"mean": sum(ordered)/len(ordered),
+                            "p95": ordered[min(len(ordered) - 1, int(0.95*len(ordered)))],
+                            "max": ordered[-1]}
+        return report
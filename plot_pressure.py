@@ -1,49 +1,115 @@
+import signal
 import CenterTwo
-from matplotlib import pyplot as plt
-import numpy as np
+import profiling
+import quality
 from datetime import datetime
-from time import time
+from time import time, monotonic
 
 serial_port = "/dev/ttyUSB0"
-sensor = CenterTwo.Controller()
-sensor.connect(serial_port)
 
 PERIOD = 2.0 # seconds
 channel = 1
 LENGTH = 400
-pressure_array = np.ones(LENGTH)*np.nan
-time_array = np.ones(LENGTH)*np.nan
 
 path_to_logs = "/home/federico/Documents/GitHub/leybold_vacuum_controller/logs/"
-logfile_name = datetime.now().strftime("%Y%d%m_%H%M%S")+".dat"
-header = "time since epoch,pressure"
-
-np.savetxt(path_to_logs+logfile_name, delimiter=',', comments='#', X=[])
-
-fig = plt.figure()
-ax = fig.gca()
-
-start_time = time()/3600.0
-
-while(True):
-    # get pressure
-    status, pressure = sensor.get_channel_pressure(channel)
-    
-    if status == CenterTwo.SENS_STATUS[0] or status == CenterTwo.SENS_STATUS[1] or status == CenterTwo.SENS_STATUS[2]:
-        pressure_array = np.roll(pressure_array, -1)
-        pressure_array[-1] = pressure
-        time_array = np.roll(time_array, -1)
-        time_array[-1] = time()/3600.0 - start_time
-        
-        with open(path_to_logs+logfile_name, 'a') as file:
-            np.savetxt(file, X=[time_array[-1], pressure_array[-1]], delimiter=',', comments='#')
-            
-    if status == CenterTwo.SENS_STATUS[1] or status == CenterTwo.SENS_STATUS[2]:
-        print(status)
-
-    ax.clear()
-    ax.set_ylabel("Pressure [mbar]")
-    ax.set_xlabel("Time since acquisition started [h]")
-    ax.plot(time_array, pressure_array)
-
-    plt.pause(PERIOD)
\ No newline at end of file
+header = "time since acquisition started [h],status,pressure"
+INDEX_SAVE_CYCLES = 30 # the quality index is saved every INDEX_SAVE_CYCLES cycles and on exit
+
+# profiling of the loop stages, toggled at runtime with "kill -USR1 <pid>",
+# the report is printed when it is switched off and on "kill -USR2 <pid>"
+profiler = profiling.Profiler(period=PERIOD)
+
+
+def toggle_profiling(signum, frame):
+    if not profiler.toggle():
+        print(profiler.report())
+
+
+def print_profiling(signum, frame):
+    print(profiler.report())
+
+
+def main():
+    # numpy and matplotlib are only needed once the acquisition starts
+    from matplotlib import pyplot as plt
+    import numpy as np
+
+    sensor = CenterTwo.Controller()
+    sensor.connect(serial_port)
+    sensor.profiler = profiler
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, toggle_profiling)
+        signal.signal(signal.SIGUSR2, print_profiling)
+
+    pressure_array = np.ones(LENGTH)*np.nan
+    time_array = np.ones(LENGTH)*np.nan
+
+    logfile_name = datetime.now().strftime("%Y%d%m_%H%M%S")+".dat"
+    np.savetxt(path_to_logs+logfile_name, delimiter=',', comments='#', X=[], header=header)
+    # every sample, failed ones included, goes into the data-quality index
+    index = quality.QualityIndex(PERIOD, channels=(channel,))
+    index_name = logfile_name[:-len(".dat")]+".quality.json"
+
+    fig = plt.figure()
+    ax = fig.gca()
+    plt.show(block=False)
+
+    start_time = time()/3600.0
+    cycle = 0
+    # a cycle starts every PERIOD seconds, whatever its own duration
+    next_cycle = monotonic()
+
+    try:
+        while(True):
+            next_cycle += PERIOD
+            profiler.begin_cycle()
+            # get pressure
+            with profiler.stage("serial"):
+                try:
+                    reading = sensor.get_channel_pressure(channel)
+                    status, pressure = CenterTwo.SENS_STATUS.index(reading[0]), reading[1]
+                except CenterTwo.CenterTwoError as error:
+                    print(error)
+                    status, pressure = quality.FAILED, np.nan
+            now = time()/3600.0 - start_time
+            index.record(channel, now*3600.0, status)
+
+            with profiler.stage("log write"):
+                with open(path_to_logs+logfile_name, 'a') as file:
+                    np.savetxt(file, X=[[now, status, pressure]], fmt=["%.8f", "%d", "%.4e"], delimiter=',', comments='#')
+                cycle += 1
+                if cycle % INDEX_SAVE_CYCLES == 0:
+                    index.save(path_to_logs+index_name)
+
+            with profiler.stage("roll"):
+                if status in quality.VALID_STATUS:
+                    pressure_array = np.roll(pressure_array, -1)
+                    pressure_array[-1] = pressure
+                    time_array = np.roll(time_array, -1)
+                    time_array[-1] = now
+
+            if status != 0:
+                print(quality.status_name(status))
+
+            with profiler.stage("plot"):
+                ax.clear()
+                ax.set_ylabel("Pressure [mbar]")
+                ax.set_xlabel("Time since acquisition started [h]")
+                ax.plot(time_array, pressure_array)
+                fig.canvas.draw_idle()
+                fig.canvas.flush_events()
+            profiler.end_cycle()
+
+            # handle the window events until the next cycle is due
+            remaining = next_cycle - monotonic()
+            if remaining > 0:
+                plt.pause(remaining)
+            else:
+                # behind schedule, start again from now instead of catching up
+                next_cycle = monotonic()
+    finally:
+        index.save(path_to_logs+index_name)
+
+
+if __name__ == "__main__":
+    main()
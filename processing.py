@@ -0,0 +1,112 @@
+import numpy as np
+from CenterTwo import SENS_STATUS, PRESSURE_UNITS, VALID_STATUS
+
+# value of one unit in Pascal, indexed like PRESSURE_UNITS
+PASCAL_PER_UNIT = np.array([100.0,                  # mbar
+                            101325.0/760.0,         # Torr
+                            1.0,                    # Pascal
+                            101325.0/760.0/1000.0]) # Micron
+
+# alternative unit names accepted besides PRESSURE_UNITS
+UNIT_ALIASES = {"Pa": 2, "micron": 3, "mTorr": 3, "torr": 1}
+
+_STATUS_INDEX = {s: i for i, s in enumerate(SENS_STATUS)}
+
+
+def unit_index(unit):
+    """
+    Index in PRESSURE_UNITS of unit, given as index (as returned by
+    Controller.get_pressure_unit) or name.
+    """
+    if isinstance(unit, str):
+        if unit in PRESSURE_UNITS:
+            return PRESSURE_UNITS.index(unit)
+        if unit in UNIT_ALIASES:
+            return UNIT_ALIASES[unit]
+        raise ValueError("Unknown pressure unit {!r}".format(unit))
+    unit = int(unit)
+    if unit < 0 or unit >= len(PRESSURE_UNITS):
+        raise ValueError("Unknown pressure unit {!r}".format(unit))
+    return unit
+
+
+def convert(values, from_unit, to_unit):
+    """
+    Convert an array of pressures between mbar, Torr, Pascal and Micron.
+
+    Parameters:
+    values (array_like): pressures in from_unit.
+    from_unit (int or str): unit of values.
+    to_unit (int or str): unit of the returned array.
+    """
+    factor = PASCAL_PER_UNIT[unit_index(from_unit)]/PASCAL_PER_UNIT[unit_index(to_unit)]
+    return np.asarray(values, dtype=float)*factor
+
+
+def status_codes(statuses):
+    """
+    Integer status codes (indices of SENS_STATUS) of an array of statuses given
+    either as codes (as written by Controller.get_pressure_into, also in a float
+    array or read back by np.loadtxt) or as the SENS_STATUS strings returned by
+    Controller.get_pressure.
+    """
+    statuses = np.asarray(statuses)
+    if statuses.dtype.kind in "iub":
+        return statuses.astype(np.int8)
+    if statuses.dtype.kind == "f":
+        if not np.all(np.isfinite(statuses) & (statuses == np.round(statuses))):
+            raise ValueError("Status codes must be whole numbers")
+        return statuses.astype(np.int8)
+    # map each distinct string once, then scatter back
+    unique, inverse = np.unique(statuses, return_inverse=True)
+    codes = np.array([_STATUS_INDEX[s] for s in unique], dtype=np.int8)
+    return codes[inverse].reshape(statuses.shape)
+
+
+def mask_invalid(values, statuses, valid=(0,)):
+    """
+    Replace with NaN the pressures whose status is not in valid.
+
+    Parameters:
+    values (array_like): pressures.
+    statuses (array_like): statuses with the same shape as values, codes or strings.
+    valid (tuple): status codes to keep, by default only "Measurement data ok";
+                   pass VALID_STATUS to also keep under and over range readings.
+
+    Returns the masked values and the status codes as parallel arrays.
+    """
+    codes = status_codes(statuses)
+    values = np.array(values, dtype=float)
+    values[~np.isin(codes, valid)] = np.nan
+    return values, codes
+
+
+def apply_correction(values, factors):
+    """
+    Apply software correction factors, broadcasting over the last axis so that a
+    (n_samples, 3) array takes one factor per channel.
+
+    Parameters:
+    values (array_like): pressures.
+    factors (float or array_like): correction factors, 0.10 to 9.99 like the
+                                   ones accepted by Controller.set_correction_factor.
+    """
+    factors = np.asarray(factors, dtype=float)
+    if np.any((factors < 0.1) | (factors > 9.99)):
+        raise ValueError("Correction factors must be between 0.10 and 9.99")
+    return np.asarray(values, dtype=float)*factors
+
+
+def process(values, statuses, from_unit=0, to_unit=0, correction=None, valid=(0,)):
+    """
+    Full post-processing of a batch of readings: invalid statuses masked as NaN,
+    correction factors applied and unit conversion.
+
+    Returns the processed values and the status codes as parallel arrays.
+    """
+    values, codes = mask_invalid(values, statuses, valid)
+    if correction is not None:
+        values = apply_correction(values, correction)
+    factor = PASCAL_PER_UNIT[unit_index(from_unit)]/PASCAL_PER_UNIT[unit_index(to_unit)]
+    values *= factor
+    return values, codes
@@ -0,0 +1,190 @@
+"""
+Deterministic per-stage profiling of the acquisition loop.
+
+A Profiler times named stages, nested stages are recorded under their
+parents ("cycle;serial;ACK wait"). Attach it to a Controller to time the
+protocol stages (command write, ACK wait, ENQ response, parse) and wrap the
+steps of the acquisition loop in profiler.stage(...) between begin_cycle() and
+end_cycle(). Profiling is toggled at runtime through the enabled attribute and
+takes effect at the next begin_cycle(); stages outside a cycle are not
+recorded, while disabled a stage costs one attribute lookup.
+
+A cycle overruns when the next one starts more than period seconds after it
+(plus tolerance), i.e. the loop fell behind its schedule.
+
+    profiler = Profiler(period=PERIOD)
+    controller.profiler = profiler
+    profiler.enabled = True
+    while True:
+        profiler.begin_cycle()
+        with profiler.stage("serial"):
+            controller.get_pressure()
+        with profiler.stage("log write"):
+            ...
+        profiler.end_cycle()
+    print(profiler.report())
+"""
+import time
+from collections import deque
+from CenterTwo import NO_STAGE
+
+CYCLE = "cycle"
+
+
+class Stage():
+    """
+    Context manager timing one stage of a Profiler.
+    """
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.profiler._stack.append(self.name)
+        self.start = self.profiler.clock()
+        return self
+
+    def __exit__(self, *exc):
+        profiler = self.profiler
+        elapsed = profiler.clock() - self.start
+        stack = profiler._stack
+        profiler._record(";".join(stack), elapsed)
+        stack.pop()
+        return False
+
+
+class Profiler():
+    """
+    Per-stage timing of an acquisition loop.
+
+    Parameters:
+    period (float): target time between the starts of two cycles in seconds,
+                    longer intervals are counted as overruns. None to only time
+                    the cycles.
+    enabled (bool): start enabled.
+    max_cycles (int): number of most recent cycle durations kept for the report.
+    tolerance (float): fraction of period an interval may exceed it by before
+                       counting as an overrun, for the scheduling jitter.
+    """
+
+    def __init__(self, period=None, enabled=False, clock=time.perf_counter, max_cycles=1000, tolerance=0.05):
+        self.period = period
+        self.tolerance = tolerance
+        self.enabled = enabled
+        self.clock = clock
+        self.stats = {}
+        self.cycles = deque(maxlen=max_cycles)
+        self.overruns = deque(maxlen=max_cycles)
+        self.cycle_count = 0
+        self.overrun_count = 0
+        self._stack = []
+        self._cycle = None
+        self._last_start = None
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        return self.enabled
+
+    def reset(self):
+        self.stats.clear()
+        self.cycles.clear()
+        self.overruns.clear()
+        self.cycle_count = 0
+        self.overrun_count = 0
+        self._last_start = None
+
+    def stage(self, name):
+        """
+        Context manager timing the stage name, a no-op while disabled or
+        outside a cycle.
+        """
+        if self._cycle is None or not self.enabled:
+            return NO_STAGE
+        return Stage(self, name)
+
+    def begin_cycle(self):
+        if not self.enabled:
+            self._cycle = None
+            self._last_start = None
+            return
+        start = self.clock()
+        if self._last_start is not None and self.period is not None:
+            interval = start - self._last_start
+            if interval > self.period*(1.0 + self.tolerance):
+                self.overrun_count += 1
+                self.overruns.append((self.cycle_count, interval))
+        self._last_start = start
+        self._stack = [CYCLE]
+        self._cycle = start
+
+    def end_cycle(self):
+        if self._cycle is None:
+            return
+        elapsed = self.clock() - self._cycle
+        self._cycle = None
+        self._record(CYCLE, elapsed)
+        self._stack = []
+        self.cycle_count += 1
+        self.cycles.append(elapsed)
+
+    def _record(self, path, elapsed):
+        stat = self.stats.get(path)
+        if stat is None:
+            self.stats[path] = [1, elapsed, elapsed]
+        else:
+            stat[0] += 1
+            stat[1] += elapsed
+            if elapsed > stat[2]:
+                stat[2] = elapsed
+
+    def self_times(self):
+        """
+        Time spent in every stage outside its child stages, keyed by path.
+        """
+        times = {path: stat[1] for path, stat in self.stats.items()}
+        for path, stat in self.stats.items():
+            parent = path.rpartition(";")[0]
+            if parent in times:
+                times[parent] -= stat[1]
+        return times
+
+    def folded(self):
+        """
+        Self times in microseconds in the folded stacks format read by
+        flamegraph.pl and speedscope, one "a;b;c count" line per stage.
+        """
+        return "\n".join("{} {:d}".format(path, max(0, int(round(t*1e6))))
+                         for path, t in sorted(self.self_times().items()))
+
+    def report(self):
+        """
+        Text report: cycle statistics, overruns and the time of every stage as
+        a share of the total cycle time, indented by nesting level.
+        """
+        lines = []
+        if self.cycles:
+            ordered = sorted(self.cycles)
+            lines.append("cycles: {:d}, mean {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms".format(
+                self.cycle_count, 1e3*sum(ordered)/len(ordered),
+                1e3*ordered[min(len(ordered) - 1, int(0.95*len(ordered)))], 1e3*ordered[-1]))
+        if self.period is not None:
+            lines.append("overruns (> {:g} s between cycle starts): {:d}".format(
+                self.period*(1.0 + self.tolerance), self.overrun_count))
+            for cycle, interval in list(self.overruns)[-5:]:
+                lines.append("  cycle {:d}: {:.2f} ms".format(cycle, 1e3*interval))
+        total = self.stats.get(CYCLE, [0, 0.0, 0.0])[1]
+        self_times = self.self_times()
+        lines.append("{:<36s}{:>8s}{:>12s}{:>10s}{:>10s}{:>8s}{:>8s}".format(
+            "stage", "calls", "total ms", "mean ms", "max ms", "%", "self %"))
+        for path in sorted(self.stats):
+            calls, elapsed, longest = self.stats[path]
+            depth = path.count(";")
+            name = "  "*depth + path.rpartition(";")[2]
+            lines.append("{:<36s}{:>8d}{:>12.2f}{:>10.3f}{:>10.3f}{:>8.1f}{:>8.1f}".format(
+                name, calls, 1e3*elapsed, 1e3*elapsed/calls, 1e3*longest,
+                100.0*elapsed/total if total else 0.0,
+                100.0*self_times[path]/total if total else 0.0))
+        return "\n".join(lines)
@@ -0,0 +1,185 @@
+import bisect
+import json
+import os
+from CenterTwo import SENS_STATUS, VALID_STATUS
+
+# pseudo status codes of samples without a reading, next to the SENS_STATUS indices
+MISSED = -1 # the sample was never taken (gap in the acquisition)
+FAILED = -2 # the read failed (acknowledgement error, timeout)
+ABSENT = -3 # the channel is not recorded in the log (see replay.load_log)
+
+QUALITY_STATUS = {MISSED: "Missed sample",
+                  FAILED: "Read failed",
+                  ABSENT: "Not recorded"}
+
+
+def status_name(code):
+    if code in QUALITY_STATUS:
+        return QUALITY_STATUS[code]
+    return SENS_STATUS[code]
+
+
+class ChannelQuality():
+    """
+    Incrementally updated quality figures of one channel.
+    """
+
+    def __init__(self):
+        self.first_time = None
+        self.last_time = None
+        self.expected = 0
+        self.valid = 0
+        self.histogram = {}
+        # gaps as parallel lists of start and end times, sorted by start
+        self.gap_starts = []
+        self.gap_ends = []
+
+    def coverage(self):
+        """
+        Fraction of the expected samples carrying a valid pressure.
+        """
+        return self.valid/self.expected if self.expected else 0.0
+
+    def to_dict(self):
+        return {"first_time": self.first_time, "last_time": self.last_time,
+                "expected": self.expected, "valid": self.valid,
+                "histogram": {str(k): v for k, v in self.histogram.items()},
+                "gap_starts": self.gap_starts, "gap_ends": self.gap_ends}
+
+    @classmethod
+    def from_dict(cls, data):
+        quality = cls()
+        quality.first_time = data["first_time"]
+        quality.last_time = data["last_time"]
+        quality.expected = data["expected"]
+        quality.valid = data["valid"]
+        quality.histogram = {int(k): v for k, v in data["histogram"].items()}
+        quality.gap_starts = list(data["gap_starts"])
+        quality.gap_ends = list(data["gap_ends"])
+        return quality
+
+
+class QualityIndex():
+    """
+    Per-channel data-quality index of an acquisition: coverage, gap list and
+    histogram of the status codes (SENS_STATUS indices, MISSED, FAILED).
+
+    Every sample, failed ones included, is passed to record(); a time step
+    longer than gap_factor periods is recorded as a gap and the samples that
+    should have been taken in it are counted as MISSED. All the figures are
+    kept up to date on each record() call, so queries never rescan the log.
+    """
+
+    def __init__(self, period, channels=(1, 2, 3), gap_factor=1.5):
+        self.period = period
+        self.gap_factor = gap_factor
+        self.channels = {channel: ChannelQuality() for channel in channels}
+
+    def record(self, channel, timestamp, status):
+        """
+        Record a sample.
+
+        Parameters:
+        channel (int): channel of the sample.
+        timestamp (float): time of the sample in seconds.
+        status (int or str): SENS_STATUS index or string, or FAILED.
+        """
+        if isinstance(status, str):
+            status = SENS_STATUS.index(status)
+        quality = self.channels.setdefault(channel, ChannelQuality())
+        if quality.first_time is None:
+            quality.first_time = timestamp
+        elif timestamp - quality.last_time > self.gap_factor*self.period:
+            missed = int(round((timestamp - quality.last_time)/self.period)) - 1
+            quality.gap_starts.append(quality.last_time)
+            quality.gap_ends.append(timestamp)
+            quality.histogram[MISSED] = quality.histogram.get(MISSED, 0) + missed
+            quality.expected += missed
+        quality.last_time = timestamp
+        quality.expected += 1
+        if status in VALID_STATUS:
+            quality.valid += 1
+        quality.histogram[status] = quality.histogram.get(status, 0) + 1
+
+    def record_failure(self, channel, timestamp):
+        self.record(channel, timestamp, FAILED)
+
+    def coverage(self, channel):
+        return self.channels[channel].coverage()
+
+    def gaps(self, channel, start=None, end=None):
+        """
+        List of (start, end) gaps of channel overlapping the interval [start, end].
+        """
+        quality = self.channels[channel]
+        first = 0
+        if start is not None:
+            # the gap starting before start may still overlap it
+            first = max(0, bisect.bisect_right(quality.gap_starts, start) - 1)
+        last = len(quality.gap_starts)
+        if end is not None:
+            last = bisect.bisect_right(quality.gap_starts, end)
+        return [(s, e) for s, e in zip(quality.gap_starts[first:last], quality.gap_ends[first:last])
+                if start is None or e >= start]
+
+    def summary(self):
+        """
+        Quality of every channel: coverage, number of gaps, longest gap and
+        status histogram with readable names.
+        """
+        summary = {}
+        for channel, quality in self.channels.items():
+            durations = [e - s for s, e in zip(quality.gap_starts, quality.gap_ends)]
+            summary[channel] = {"coverage": quality.coverage(),
+                                "expected": quality.expected,
+                                "valid": quality.valid,
+                                "gaps": len(durations),
+                                "longest_gap": max(durations, default=0.0),
+                                "histogram": {status_name(k): v for k, v in sorted(quality.histogram.items())}}
+        return summary
+
+    def is_trustworthy(self, min_coverage=0.99, max_gap=None):
+        """
+        True if every channel reaches min_coverage and, if given, has no gap
+        longer than max_gap seconds.
+        """
+        for quality in self.channels.values():
+            if quality.expected and quality.coverage() < min_coverage:
+                return False
+            if max_gap is not None and any(e - s > max_gap for s, e in zip(quality.gap_starts, quality.gap_ends)):
+                return False
+        return True
+
+    def save(self, path):
+        """
+        Write the index as JSON, next to the log it describes. The file is
+        replaced atomically, a crash while saving leaves the previous index.
+        """
+        data = {"period": self.period, "gap_factor": self.gap_factor,
+                "channels": {str(c): q.to_dict() for c, q in self.channels.items()}}
+        temporary = path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(data, file)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            data = json.load(file)
+        index = cls(data["period"], channels=(), gap_factor=data["gap_factor"])
+        index.channels = {int(c): ChannelQuality.from_dict(q) for c, q in data["channels"].items()}
+        return index
+
+    @classmethod
+    def from_log(cls, path, period, time_scale=3600.0, gap_factor=1.5):
+        """
+        Build the index of an existing log (see replay.load_log) in one pass.
+        """
+        import replay
+        times, _, status = replay.load_log(path, time_scale)
+        channels = [c + 1 for c in range(status.shape[1]) if (status[:, c] != ABSENT).any()]
+        index = cls(period, channels, gap_factor)
+        for row, timestamp in enumerate(times.tolist()):
+            for channel in channels:
+                index.record(channel, timestamp, int(status[row, channel - 1]))
+        return index
@@ -0,0 +1,198 @@
+import time
+import numpy as np
+from CenterTwo import CR, LF, NO_TRANSMITTER
+from quality import ABSENT, FAILED, MISSED
+from simulator import SimulatedController, LoopbackTransport
+
+# pressure of the channels missing from a log, their status is ABSENT
+MISSING_PRESSURE = 0.0
+
+# statuses of the samples without a reading, the controller did not answer
+NO_ANSWER_STATUS = (FAILED, MISSED)
+
+
+class _NoAnswer(Exception):
+    """
+    The sample being served has no reading.
+    """
+    pass
+
+
+def load_log(path, time_scale=3600.0):
+    """
+    Load a recorded log.
+
+    Text logs (.dat, .csv) hold comma separated rows with the time followed either
+    by the pressures of 1 or 3 channels (2 or 4 columns) or by status,pressure
+    pairs of 1 or 3 channels (3 or 7 columns). The single column layout written
+    by earlier versions of plot_pressure.py (time and pressure on alternate lines)
+    is also accepted. Binary logs are .npz archives written by save_log.
+
+    Parameters:
+    path (str): log file.
+    time_scale (float): seconds per unit of the time column of text logs, 3600 for
+                        the hours written by plot_pressure.py.
+
+    Returns times in seconds, pressures and status codes as (n, 3) arrays. The
+    channels not recorded in the log have status quality.ABSENT.
+    """
+    if str(path).endswith(".npz"):
+        with np.load(path) as archive:
+            return archive["time"].astype(float), archive["pressure"].astype(float), archive["status"].astype(np.int8)
+
+    data = np.loadtxt(path, delimiter=",", comments="#", ndmin=2)
+    if data.shape[1] == 1:
+        data = data.reshape(-1, 2)
+    times = data[:, 0]*time_scale
+    columns = data.shape[1] - 1
+    pressure = np.full((len(data), 3), MISSING_PRESSURE)
+    status = np.full((len(data), 3), ABSENT, dtype=np.int8)
+    if columns in (1, 3):
+        pressure[:, :columns] = data[:, 1:]
+        status[:, :columns] = 0
+    elif columns in (2, 6):
+        pressure[:, :columns//2] = data[:, 2::2]
+        status[:, :columns//2] = data[:, 1::2]
+    else:
+        raise ValueError("Unsupported log layout with {:d} columns".format(data.shape[1]))
+    return times, pressure, status
+
+
+def save_log(path, times, pressure, status):
+    """
+    Write a binary .npz log readable by load_log.
+
+    Parameters:
+    times (array_like): times in seconds.
+    pressure (array_like): (n, 3) pressures.
+    status (array_like): (n, 3) status codes.
+    """
+    np.savez(path, time=np.asarray(times, dtype=float), pressure=np.asarray(pressure, dtype=float),
+             status=np.asarray(status, dtype=np.int8))
+
+
+class ReplayController(SimulatedController):
+    """
+    SimulatedController serving recorded measurements.
+
+    Polled readings (PRX, PR#) return the sample due at the current replay time,
+    in continuous mode (COM) every recorded sample is sent at its recorded time.
+    With speed=None the log is served as fast as possible: every reading
+    returns the next sample. Once the log is exhausted polled readings repeat the
+    last sample and the continuous mode stops sending, unless loop is True.
+
+    Samples recorded as FAILED or MISSED are served as the failure they
+    stand for: the reading gets no answer (ResponseTimeoutError on the
+    client), in continuous mode nothing is sent for them.
+    """
+
+    def __init__(self, times, pressure, status, speed=1.0, loop=False, **kwargs):
+        super().__init__(**kwargs)
+        self.times = np.asarray(times, dtype=float)
+        self.samples_pressure = np.asarray(pressure, dtype=float)
+        # channels missing from the log are served as without transmitter
+        status = np.asarray(status, dtype=np.int8)
+        self.samples_status = np.where(status == ABSENT, NO_TRANSMITTER, status).astype(np.int8)
+        if not len(self.times):
+            raise ValueError("Empty log")
+        if speed is not None and not speed > 0:
+            raise ValueError("Replay speed must be positive, got {!r}".format(speed))
+        # duration of one pass over the log when looping
+        spacing = np.median(np.diff(self.times)) if len(self.times) > 1 else 1.0
+        self.lap = self.times[-1] - self.times[0] + (spacing if spacing > 0 else 1.0)
+        self.speed = speed
+        self.loop = loop
+        self.index = -1
+        self.finished = False
+        self._start = None
+
+    @classmethod
+    def from_log(cls, path, speed=1.0, loop=False, time_scale=3600.0, **kwargs):
+        return cls(*load_log(path, time_scale), speed=speed, loop=loop, **kwargs)
+
+    def _due(self, index):
+        """
+        Clock time at which sample index is due.
+        """
+        laps, index = divmod(index, len(self.times))
+        elapsed = self.times[index] - self.times[0] + laps*self.lap
+        return self._start + elapsed/self.speed
+
+    def _select(self, index):
+        if index >= len(self.times) and not self.loop:
+            self.finished = True
+            index = len(self.times) - 1
+        self.index = index
+        sample = index % len(self.times)
+        self.pressures = self.samples_pressure[sample].tolist()
+        self.statuses = self.samples_status[sample].tolist()
+
+    def update(self):
+        if self._start is None:
+            self._start = self.clock()
+        if self.speed is None:
+            self._select(self.index + 1)
+            return
+        now = self.clock()
+        index = max(self.index, 0)
+        last = None if self.loop else len(self.times) - 1
+        # skip the samples that became due since the previous reading
+        while (last is None or index < last) and self._due(index + 1) <= now:
+            index += 1
+        self._select(index)
+
+    def poll(self, timeout=0):
+        with self.lock:
+            if self.continuous_period is None or self.finished:
+                delay = None
+            elif self.speed is None:
+                delay = 0.0
+            else:
+                delay = self._due(self.index + 1) - self.clock()
+        if delay is None or delay > timeout:
+            if timeout > 0:
+                time.sleep(timeout)
+            return b""
+        if delay > 0:
+            time.sleep(delay)
+        with self.lock:
+            if self.continuous_period is None:
+                return b""
+            self._select(self.index + 1)
+            if self.finished:
+                return b""
+            try:
+                line = ",".join(self._pressure(i) for i in range(3))
+            except _NoAnswer:
+                return b""
+            return line.encode() + CR + LF
+
+    def enquiry(self):
+        try:
+            return super().enquiry()
+        except _NoAnswer:
+            return b""
+
+    def _pressure(self, channel):
+        if self.statuses[channel] in NO_ANSWER_STATUS:
+            raise _NoAnswer()
+        return super()._pressure(channel)
+
+    def _cmd_COM(self, mnemonic, arguments):
+        # the recorded timestamps set the pace, not the requested period
+        self.continuous_period = 0.0
+        self.update()
+        return ",".join(self._pressure(i) for i in range(3))
+
+
+def open_replay(path, speed=1.0, loop=False, time_scale=3600.0, timeout=1):
+    """
+    Transport serving a recorded log to Controller.connect_transport.
+
+    Parameters:
+    path (str): log file, see load_log.
+    speed (float): replay speed, 1.0 for real time, N for N times real time,
+                   None for as fast as possible.
+    loop (bool): start again from the beginning when the log is exhausted.
+    """
+    return LoopbackTransport(ReplayController.from_log(path, speed, loop, time_scale), timeout=timeout)
@@ -0,0 +1,469 @@
+"""
+Live data fan-out server.
+
+One process owns the controllers and acquires once, readings are fanned out to
+any number of local viewers:
+
+GET /stream?controller=NAME&every=N  Server-Sent Events, one reading per event
+GET /ws?controller=NAME&every=N      WebSocket, one JSON text frame per reading
+GET /latest                          last reading of every controller
+GET /history?controller=NAME&start=T0&end=T1
+                                     readings between two epoch times, failed
+                                     reads have status -2 and a null pressure
+
+every=N forwards one reading out of N. Every viewer has a bounded queue: a
+viewer too slow to keep up loses its oldest readings instead of slowing the
+acquisition down, the number of dropped readings is sent with every message.
+
+Usage: python server.py main=/dev/ttyUSB0 [rack2=socket://host:port ...] [--port 8000]
+"""
+import argparse
+import base64
+import bisect
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import CenterTwo
+import quality
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# readings kept for a viewer before the oldest ones are dropped
+QUEUE_LENGTH = 256
+
+# readings of every controller kept in memory for /history
+HISTORY_LENGTH = 86400
+
+# seconds between attempts to reopen a lost connection, doubled at every failed attempt
+RECONNECT_BACKOFF = 1.0
+RECONNECT_MAX_BACKOFF = 60.0
+
+# log header, times in seconds since epoch
+LOG_HEADER = "time since epoch [s],status 1,pressure 1,status 2,pressure 2,status 3,pressure 3"
+
+
+class Subscriber():
+    """
+    Bounded queue of the readings sent to one viewer.
+    """
+
+    def __init__(self, controller=None, every=1, length=QUEUE_LENGTH):
+        self.controller = controller
+        self.every = max(1, every)
+        self.queue = deque(maxlen=length)
+        self.dropped = 0
+        self.ready = threading.Condition()
+        # decimation counts, one per controller
+        self._counts = {}
+
+    def offer(self, controller, message):
+        if self.controller is not None and controller != self.controller:
+            return
+        count = self._counts.get(controller, 0) + 1
+        self._counts[controller] = count
+        if count % self.every:
+            return
+        with self.ready:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(message)
+            self.ready.notify()
+
+    def get(self, timeout=None):
+        """
+        Next message, None if nothing arrives within timeout.
+        """
+        with self.ready:
+            if not self.queue:
+                self.ready.wait(timeout)
+            if not self.queue:
+                return None
+            return self.queue.popleft()
+
+
+class Broadcaster():
+    """
+    Fans each reading out to the subscribers. A reading is encoded once,
+    publishing only appends it to the subscriber queues and never blocks.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.latest = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def snapshot(self):
+        """
+        Last encoded reading of every controller.
+        """
+        with self._lock:
+            return dict(self.latest)
+
+    def publish(self, controller, reading):
+        message = json.dumps(reading)
+        with self._lock:
+            self.latest[controller] = message
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(controller, message)
+
+
+class History():
+    """
+    Most recent readings of one controller, so that /history queries do not
+    reread the log. The readings from since on are all held, older ones are
+    only in the log.
+    """
+
+    def __init__(self, length=HISTORY_LENGTH, since=float("-inf")):
+        self.length = length
+        self.since = since
+        self.times = []
+        self.status = []
+        self.pressure = []
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, status, pressure):
+        with self._lock:
+            self.times.append(timestamp)
+            self.status.append(status)
+            self.pressure.append(pressure)
+            # trim in blocks to keep appending O(1)
+            if len(self.times) > 2*self.length:
+                del self.times[:-self.length]
+                del self.status[:-self.length]
+                del self.pressure[:-self.length]
+                self.since = self.times[0]
+
+    def query(self, start, end):
+        """
+        Held readings between start and end as (times, status, pressure) lists.
+        """
+        with self._lock:
+            first = bisect.bisect_left(self.times, start)
+            last = bisect.bisect_right(self.times, end)
+            return self.times[first:last], self.status[first:last], self.pressure[first:last]
+
+
+class Acquisition():
+    """
+    Reads all the controllers every period seconds, logs the readings and
+    publishes them to a Broadcaster.
+
+    A controller whose connection fails (TransportError) is reconnected before
+    its next reading; while the connection cannot be reopened the attempts
+    back off from RECONNECT_BACKOFF to RECONNECT_MAX_BACKOFF seconds and its
+    readings are published and logged as failed.
+
+    Parameters:
+    controllers (dict): name to connected Controller.
+    period (float): seconds between readings.
+    log_dir (str): directory of the <name>.dat logs, None to disable logging.
+    history_length (int): readings of every controller kept in memory.
+    """
+
+    def __init__(self, controllers, broadcaster, period=1.0, log_dir=None, history_length=HISTORY_LENGTH):
+        self.controllers = controllers
+        self.broadcaster = broadcaster
+        self.period = period
+        self.log_dir = log_dir
+        self.stop = threading.Event()
+        self.history = {name: History(history_length) for name in controllers}
+        self._logs = {}
+        # monotonic time of the next reconnection attempt of the lost controllers
+        self._reconnect_due = {}
+        # wait after the next failed attempt, reset by a successful reading
+        self._backoff = {}
+
+    def log_path(self, name):
+        return os.path.join(self.log_dir, name + ".dat")
+
+    def _open_logs(self):
+        for name in self.controllers:
+            path = self.log_path(name)
+            new = not os.path.exists(path)
+            self._logs[name] = open(path, "a", buffering=1)
+            if new:
+                self._logs[name].write("# " + LOG_HEADER + "\n")
+            else:
+                # the readings of earlier runs are only in the log
+                self.history[name].since = time.time()
+
+    def _schedule_reconnect(self, name):
+        delay = self._backoff.get(name, 0.0)
+        self._reconnect_due[name] = time.monotonic() + delay
+        self._backoff[name] = min(max(2*delay, RECONNECT_BACKOFF), RECONNECT_MAX_BACKOFF)
+
+    def _reconnect(self, name, controller):
+        """
+        Reopen the connection of controller once the attempt is due. Returns
+        True if it is open again.
+        """
+        if time.monotonic() < self._reconnect_due[name]:
+            return False
+        try:
+            controller.reconnect()
+        except OSError:
+            # closing a port that has gone away
+            controller.is_connected = False
+        if not controller.is_connected:
+            self._schedule_reconnect(name)
+            return False
+        del self._reconnect_due[name]
+        return True
+
+    def read(self, name, controller):
+        now = time.time()
+        error = None
+        if name in self._reconnect_due and not self._reconnect(name, controller):
+            error = "{}: reconnecting".format(CenterTwo.TRANSPORT_ERROR)
+        else:
+            try:
+                status, value = controller.get_pressure()
+                codes = [CenterTwo.SENS_STATUS.index(s) for s in status]
+                self._backoff.pop(name, None)
+            except CenterTwo.TransportError as transport_error:
+                error = str(transport_error)
+                self._schedule_reconnect(name)
+            except CenterTwo.CenterTwoError as read_error:
+                error = str(read_error)
+        if error is None:
+            reading = {"controller": name, "time": now, "status": codes, "pressure": value}
+        else:
+            reading = {"controller": name, "time": now, "error": error}
+            # failed reads are kept too, so that the history has no silent holes
+            codes = [quality.FAILED]*3
+            value = [math.nan]*3
+        self.history[name].append(now, codes, value)
+        if name in self._logs:
+            fields = ",".join("{:d},{:.4e}".format(s, p) for s, p in zip(codes, value))
+            self._logs[name].write("{:.3f},{}\n".format(now, fields))
+        return reading
+
+    def run(self):
+        if self.log_dir is not None:
+            self._open_logs()
+        next_read = time.monotonic()
+        try:
+            while not self.stop.is_set():
+                for name, controller in self.controllers.items():
+                    self.broadcaster.publish(name, self.read(name, controller))
+                next_read += self.period
+                self.stop.wait(max(0.0, next_read - time.monotonic()))
+        finally:
+            for log in self._logs.values():
+                log.close()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+
+class QueryError(ValueError):
+    """
+    Invalid query parameter, answered with 400 Bad Request.
+    """
+    pass
+
+
+def query_number(query, key, convert, default, minimum=None):
+    """
+    Query parameter key converted with convert (int or float), default if absent.
+    Raises QueryError if it is not a number or below minimum.
+    """
+    if key not in query:
+        return default
+    try:
+        value = convert(query[key])
+    except ValueError:
+        raise QueryError("Invalid {}: {!r}".format(key, query[key])) from None
+    if value != value or (minimum is not None and value < minimum):
+        raise QueryError("Invalid {}: {!r}".format(key, query[key]))
+    return value
+
+
+def websocket_frame(text):
+    """
+    Unmasked WebSocket text frame carrying text.
+    """
+    payload = text.encode()
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x81, length])
+    elif length < 1 << 16:
+        header = bytes([0x81, 126]) + length.to_bytes(2, "big")
+    else:
+        header = bytes([0x81, 127]) + length.to_bytes(8, "big")
+    return header + payload
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # WebSocket upgrades require HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        routes = {"/stream": self.stream,
+                  "/ws": self.websocket,
+                  "/latest": self.latest,
+                  "/history": self.history}
+        if url.path not in routes:
+            self.send_error(404)
+            return
+        try:
+            routes[url.path](query)
+        except QueryError as error:
+            # raised before anything is sent
+            self.send_error(400, str(error))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _subscriber(self, query):
+        return Subscriber(query.get("controller"), query_number(query, "every", int, 1, minimum=1))
+
+    def _send_json(self, body):
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _forward(self, subscriber, encode):
+        broadcaster = self.server.broadcaster
+        broadcaster.subscribe(subscriber)
+        try:
+            while not self.server.stopping:
+                message = subscriber.get(timeout=1.0)
+                if message is None:
+                    continue
+                if subscriber.dropped:
+                    message = message[:-1] + ', "dropped": {:d}}}'.format(subscriber.dropped)
+                self.wfile.write(encode(message))
+                self.wfile.flush()
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    def stream(self, query):
+        subscriber = self._subscriber(query)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self._forward(subscriber, lambda message: ("data: " + message + "\n\n").encode())
+
+    def websocket(self, query):
+        key = self.headers.get("Sec-WebSocket-Key")
+        if key is None or self.headers.get("Upgrade", "").lower() != "websocket":
+            self.send_error(400, "WebSocket upgrade expected")
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        subscriber = self._subscriber(query)
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self._forward(subscriber, websocket_frame)
+
+    def latest(self, query):
+        latest = self.server.broadcaster.snapshot()
+        # the readings are already encoded, only the names need escaping
+        self._send_json("{" + ", ".join("{}: {}".format(json.dumps(k), v) for k, v in latest.items()) + "}")
+
+    def history(self, query):
+        name = query.get("controller")
+        if name not in self.server.controllers:
+            self.send_error(404, "Unknown controller")
+            return
+        start = query_number(query, "start", float, -math.inf)
+        end = query_number(query, "end", float, math.inf)
+        history = self.server.acquisition.history[name]
+        if start < history.since and self.server.log_dir is not None:
+            # older than the readings held in memory, read the log
+            import numpy as np
+            import replay
+            times, pressure, status = replay.load_log(self.server.acquisition.log_path(name), time_scale=1.0)
+            first = np.searchsorted(times, start, side="left")
+            last = np.searchsorted(times, end, side="right")
+            readings = times[first:last].tolist(), status[first:last].tolist(), pressure[first:last].tolist()
+        else:
+            readings = history.query(start, end)
+        times, status, pressure = readings
+        # NaN is not valid JSON
+        pressure = [[None if math.isnan(p) else p for p in row] for row in pressure]
+        self._send_json(json.dumps({"controller": name, "time": times, "status": status, "pressure": pressure}))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FanOutServer(ThreadingHTTPServer):
+    """
+    HTTP server handing the readings of an Acquisition to the viewers.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, controllers, period=1.0, log_dir=None):
+        super().__init__(address, RequestHandler)
+        self.controllers = controllers
+        self.log_dir = log_dir
+        self.stopping = False
+        self.broadcaster = Broadcaster()
+        self.acquisition = Acquisition(controllers, self.broadcaster, period, log_dir)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.acquisition.start()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self.stopping = True
+            self.acquisition.stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Acquire CENTER TWO controllers once and serve the readings to many viewers.")
+    parser.add_argument("controllers", nargs="+", help="NAME=PORT, PORT as accepted by Controller.connect")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--period", type=float, default=1.0)
+    parser.add_argument("--log-dir", default="logs")
+    args = parser.parse_args(argv)
+
+    controllers = {}
+    for spec in args.controllers:
+        name, _, port = spec.partition("=")
+        controller = CenterTwo.Controller()
+        controller.connect(port)
+        if not controller.is_connected:
+            return 1
+        controllers[name] = controller
+
+    server = FanOutServer((args.host, args.port), controllers, args.period, args.log_dir)
+    print("Serving on http://{}:{:d}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
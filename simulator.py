@@ -0,0 +1,258 @@
+import select
+import socketserver
+import threading
+import time
+from CenterTwo import ACK, NAK, ENQ, CR, LF, SETPOINTS
+
+# seconds between measurements for the COM period codes
+CONTINUOUS_PERIODS = [0.1, 1.0, 60.0]
+
+
+class SimulatedController():
+    """
+    Software model of a CENTER TWO answering the serial protocol: a command
+    terminated by CR LF is acknowledged with ACK (or NAK if it is unknown or
+    invalid), the answer is sent when ENQ is received.
+    """
+
+    def __init__(self, pressures=(1.0e-3, 1.0e-3, 1.0e-3), statuses=(0, 0, 0),
+                 transmitter_ids=("TTR91", "TTR91", "noSEn"), program_number="BG551000-A"):
+        self.pressures = list(pressures)
+        self.statuses = list(statuses)
+        self.transmitter_ids = list(transmitter_ids)
+        self.program_number = program_number
+        self.settings = {"AOM": "0,0", "BAU": "0", "COR": "1.00,1.00,1.00", "DCD": "2", "PRE": "0,0,0", "UNI": "0",
+                         "SP1": "0,1.0000E-03,2.0000E-03", "SP2": "1,1.0000E-03,2.0000E-03",
+                         "SP3": "2,1.0000E-03,2.0000E-03", "SP4": "0,1.0000E+02,2.0000E+02"}
+        self.relays = [0]*SETPOINTS
+        self.error_status = "0000"
+        self.queued_errors = [0]
+        self.continuous_period = None
+        self.clock = time.monotonic
+        self.lock = threading.Lock()
+        self._next_emission = None
+        self._command = None
+        self._rx = bytearray()
+
+    def receive(self, data):
+        """
+        Feed bytes written by the host, return the bytes sent back.
+        """
+        out = bytearray()
+        with self.lock:
+            self._rx += data
+            while self._rx:
+                if self._rx[0] == ENQ[0]:
+                    del self._rx[0]
+                    out += self.enquiry()
+                    continue
+                eol = self._rx.find(CR + LF)
+                if eol == -1:
+                    break
+                line = bytes(self._rx[:eol]).decode(errors="replace")
+                del self._rx[:eol + 2]
+                out += self.command(line)
+        return bytes(out)
+
+    def command(self, line):
+        mnemonic, _, arguments = line.partition(",")
+        handler = getattr(self, "_cmd_" + mnemonic.replace("#", ""), None)
+        if handler is None and mnemonic in self.settings:
+            handler = self._setting
+        if handler is None:
+            self._command = None
+            self.error_status = "0001"
+            return NAK + CR + LF
+        # any command ends the continuous mode
+        self.continuous_period = None
+        self._command = (handler, mnemonic, arguments)
+        return ACK + CR + LF
+
+    def enquiry(self):
+        if self._command is None:
+            return b""
+        handler, mnemonic, arguments = self._command
+        return handler(mnemonic, arguments).encode() + CR + LF
+
+    def poll(self, timeout=0):
+        """
+        Bytes sent spontaneously in continuous mode, waiting at most timeout
+        seconds for the next measurement.
+        """
+        with self.lock:
+            if self.continuous_period is None:
+                delay = None
+            else:
+                delay = self._next_emission - self.clock()
+        if delay is None or delay > timeout:
+            if timeout > 0:
+                time.sleep(timeout)
+            return b""
+        if delay > 0:
+            time.sleep(delay)
+        with self.lock:
+            if self.continuous_period is None:
+                return b""
+            self._next_emission += self.continuous_period
+            return self._cmd_PRX("PRX", "").encode() + CR + LF
+
+    def update(self):
+        """
+        Called before every pressure reading, subclasses refresh the pressures here.
+        """
+        pass
+
+    def _pressure(self, channel):
+        return "{:d},{:.4E}".format(self.statuses[channel], self.pressures[channel])
+
+    def _setting(self, mnemonic, arguments):
+        if arguments:
+            self.settings[mnemonic] = arguments
+        return self.settings[mnemonic]
+
+    def _cmd_PRX(self, mnemonic, arguments):
+        self.update()
+        return ",".join(self._pressure(i) for i in range(3))
+
+    def _cmd_PR1(self, mnemonic, arguments):
+        self.update()
+        return self._pressure(0)
+
+    def _cmd_PR2(self, mnemonic, arguments):
+        self.update()
+        return self._pressure(1)
+
+    def _cmd_PR3(self, mnemonic, arguments):
+        self.update()
+        return self._pressure(2)
+
+    def _cmd_COM(self, mnemonic, arguments):
+        period = int(arguments) if arguments else 1
+        self.continuous_period = CONTINUOUS_PERIODS[period]
+        self._next_emission = self.clock() + self.continuous_period
+        return self._cmd_PRX(mnemonic, arguments)
+
+    def _cmd_SPS(self, mnemonic, arguments):
+        self.update()
+        # relays switch on below the lower threshold and off above the upper one
+        for i in range(SETPOINTS):
+            channel, lower, upper = self.settings["SP{:d}".format(i + 1)].split(",")
+            pressure = self.pressures[int(channel)]
+            if pressure < float(lower):
+                self.relays[i] = 1
+            elif pressure > float(upper):
+                self.relays[i] = 0
+        return ",".join(str(r) for r in self.relays)
+
+    def _cmd_TID(self, mnemonic, arguments):
+        return ",".join(self.transmitter_ids)
+
+    def _cmd_PNR(self, mnemonic, arguments):
+        return self.program_number
+
+    def _cmd_ERR(self, mnemonic, arguments):
+        status = self.error_status
+        self.error_status = "0000"
+        return status
+
+    def _cmd_RES(self, mnemonic, arguments):
+        errors = self.queued_errors
+        self.queued_errors = [0]
+        self._rx.clear()
+        return ",".join(str(e) for e in errors)
+
+
+class LoopbackTransport():
+    """
+    In-memory transport connecting a Controller to a SimulatedController,
+    implementing the subset of the serial.Serial interface used by Controller.
+    """
+
+    def __init__(self, device, timeout=1):
+        self.device = device
+        self.timeout = timeout
+        self._rx = bytearray()
+        self.is_open = True
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def write(self, data):
+        self._rx += self.device.receive(bytes(data))
+        return len(data)
+
+    def readline(self):
+        if self._rx.find(LF) == -1:
+            # nothing pending, wait for continuous mode data like a serial timeout
+            self._rx += self.device.poll(self.timeout)
+        eol = self._rx.find(LF)
+        end = len(self._rx) if eol == -1 else eol + 1
+        line = bytes(self._rx[:end])
+        del self._rx[:end]
+        return line
+
+    def read(self, size=1):
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def readinto(self, buffer):
+        if not self._rx:
+            self._rx += self.device.poll(self.timeout)
+        n = min(len(buffer), len(self._rx))
+        buffer[:n] = self._rx[:n]
+        del self._rx[:n]
+        return n
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+
+    def close(self):
+        self.is_open = False
+
+
+class _DeviceHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        device = self.server.device
+        while True:
+            readable, _, _ = select.select([self.request], [], [], 0.01)
+            if readable:
+                data = self.request.recv(4096)
+                if not data:
+                    break
+                response = device.receive(data)
+            else:
+                # forward continuous mode measurements
+                response = device.poll(0)
+            if response:
+                self.request.sendall(response)
+
+
+class DeviceServer(socketserver.ThreadingTCPServer):
+    """
+    TCP server exposing a SimulatedController like an Ethernet terminal server.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, device, host="127.0.0.1", port=0):
+        self.device = device
+        super().__init__((host, port), _DeviceHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "socket://{}:{:d}".format(host, port)
+
+
+def serve_tcp(device, host="127.0.0.1", port=0):
+    """
+    Start a DeviceServer in a background thread and return it. Pass port=0 to
+    pick a free port, the address to connect to is in server.url.
+    """
+    server = DeviceServer(device, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+import analytics
+
+
+@pytest.mark.parametrize("p_start", [1.0e-4, 1.0e-3, 3.0e-3])
+def test_linear_rise_has_no_edge_segments(p_start):
+    times = np.arange(0.0, 6000.0, 2.0)
+    result = analytics.analyse_channel(times, p_start + 1.0e-6*times)
+    assert set(result["kind"]) == {analytics.RISE}
+    assert result["samples"].min() >= 5
+    np.testing.assert_allclose(result["dpdt"], 1.0e-6, rtol=1e-6)
+
+
+def test_local_slopes_are_unbiased_at_the_edges():
+    times = np.arange(10.0)
+    slopes = analytics.local_slopes(times, 3.0*times + 1.0, 5)
+    np.testing.assert_allclose(slopes, 3.0)
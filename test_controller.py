@@ -0,0 +1,148 @@
+import pytest
+import CenterTwo
+import simulator
+
+
+def connect(device, retry_policy=None):
+    controller = CenterTwo.Controller(retry_policy)
+    controller.connect_transport(simulator.LoopbackTransport(device, timeout=0.05))
+    return controller
+
+
+@pytest.mark.parametrize("code", [-1, 8])
+def test_unknown_sensor_status_is_a_desync(code):
+    device = simulator.SimulatedController(statuses=(0, code, 0))
+    controller = connect(device, CenterTwo.no_retry())
+    with pytest.raises(CenterTwo.DesyncError):
+        controller.get_pressure()
+
+
+@pytest.mark.parametrize("code", [-1, 8])
+def test_unknown_sensor_status_is_a_desync_on_the_fast_path(code):
+    device = simulator.SimulatedController(statuses=(0, code, 0))
+    controller = connect(device, CenterTwo.no_retry())
+    with pytest.raises(CenterTwo.DesyncError):
+        controller.get_pressure_into([0]*3, [0.0]*3)
+
+
+class BadErrorStatus(simulator.SimulatedController):
+
+    def _cmd_ERR(self, mnemonic, arguments):
+        return ""
+
+
+def test_malformed_error_status_is_a_desync():
+    controller = connect(BadErrorStatus(), CenterTwo.no_retry())
+    with pytest.raises(CenterTwo.DesyncError):
+        controller.get_error_status()
+
+
+def test_malformed_error_status_during_recovery():
+    controller = connect(BadErrorStatus(), CenterTwo.RetryPolicy(attempts=2, backoff=0))
+    with pytest.raises(CenterTwo.NakError):
+        controller.query(b"XYZ")
+
+
+class FaultyController(simulator.SimulatedController):
+    """
+    Answers the first commands of a mnemonic with the replies queued in faults
+    instead of ACK: NAK, garbage or nothing at all.
+    """
+
+    def __init__(self, faults=None, **kwargs):
+        super().__init__(**kwargs)
+        self.faults = {mnemonic: list(replies) for mnemonic, replies in (faults or {}).items()}
+        self.received = []
+
+    def command(self, line):
+        mnemonic = line.partition(",")[0]
+        self.received.append(mnemonic)
+        replies = self.faults.get(mnemonic)
+        if replies:
+            self._command = None
+            return replies.pop(0)
+        return super().command(line)
+
+
+NAK_REPLY = CenterTwo.NAK + CenterTwo.CR + CenterTwo.LF
+GARBAGE_REPLY = b"\xff?" + CenterTwo.CR + CenterTwo.LF
+NO_REPLY = b""
+
+
+def policy(**kwargs):
+    kwargs.setdefault("backoff", 0)
+    return CenterTwo.RetryPolicy(**kwargs)
+
+
+def test_nak_is_retried():
+    retry_policy = policy(attempts=3)
+    controller = connect(FaultyController({"PRX": [NAK_REPLY, NAK_REPLY]}), retry_policy)
+    assert controller.get_pressure()[1] == [1.0e-3]*3
+    assert retry_policy.retries == 2
+    assert retry_policy.failures == 0
+
+
+def test_attempts_are_limited():
+    retry_policy = policy(attempts=2)
+    controller = connect(FaultyController({"PRX": [NAK_REPLY]*2}), retry_policy)
+    with pytest.raises(CenterTwo.NakError):
+        controller.get_pressure()
+    assert retry_policy.retries == 1
+    assert retry_policy.failures == 1
+
+
+def test_budget_overrides_attempts():
+    retry_policy = policy(attempts=3, budgets={"PR2": 1})
+    device = FaultyController({"PR1": [NAK_REPLY], "PR2": [NAK_REPLY, NAK_REPLY]})
+    controller = connect(device, retry_policy)
+    assert controller.get_channel_pressure(1)[1] == 1.0e-3
+    with pytest.raises(CenterTwo.NakError):
+        controller.get_channel_pressure(2)
+    # the fast path uses the same budget keys
+    with pytest.raises(CenterTwo.NakError):
+        controller.get_channel_pressure_into(2, [0], [0.0])
+
+
+def test_deadline_stops_retries():
+    retry_policy = policy(attempts=5, backoff=0.1, jitter=0, deadline=0.05)
+    controller = connect(FaultyController({"PRX": [NAK_REPLY]}), retry_policy)
+    with pytest.raises(CenterTwo.NakError):
+        controller.get_pressure()
+    assert retry_policy.retries == 0
+
+
+def test_timeouts_are_not_retried_by_default():
+    retry_policy = policy(attempts=3)
+    controller = connect(FaultyController({"PRX": [NO_REPLY]}), retry_policy)
+    with pytest.raises(CenterTwo.ResponseTimeoutError):
+        controller.get_pressure()
+    assert retry_policy.retries == 0
+
+
+def test_retry_timeouts():
+    retry_policy = policy(attempts=3, retry_timeouts=True)
+    controller = connect(FaultyController({"PRX": [NO_REPLY]}), retry_policy)
+    assert controller.get_pressure()[1] == [1.0e-3]*3
+    assert retry_policy.retries == 1
+
+
+def test_nak_reads_error_status():
+    device = FaultyController({"PRX": [NAK_REPLY]})
+    device.error_status = "1000"
+    controller = connect(device, policy(attempts=3))
+    with pytest.raises(CenterTwo.DeviceError) as error:
+        controller.get_pressure()
+    assert error.value.status == "1000"
+    assert error.value.errors == [CenterTwo.DEV_ERR]
+    assert device.received == ["PRX", "ERR"]
+
+
+def test_desync_resets_the_interface():
+    device = FaultyController({"PRX": [GARBAGE_REPLY]})
+    controller = connect(device, policy(attempts=3))
+    assert controller.get_pressure()[1] == [1.0e-3]*3
+    assert device.received == ["PRX", "RES", "PRX"]
+
+
+def test_no_retry_policies_are_not_shared():
+    assert CenterTwo.no_retry() is not CenterTwo.no_retry()
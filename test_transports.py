@@ -0,0 +1,99 @@
+import pytest
+import serial
+import CenterTwo
+import simulator
+import transports
+
+
+@pytest.fixture
+def server():
+    device = simulator.SimulatedController(pressures=(1.0e-3, 2.5e-2, 3.0e2), statuses=(0, 1, 5))
+    server = simulator.serve_tcp(device)
+    yield server
+    server.shutdown()
+    server.server_close()
+    transports.POOL.close_all()
+
+
+def test_socket_transport_reads_prx(server):
+    controller = CenterTwo.Controller()
+    controller.connect(server.url, timeout=1)
+    assert controller.is_connected
+    assert isinstance(controller.serial_com, transports.SocketTransport)
+
+    status, value = controller.get_pressure()
+    assert status == ["Measurement data ok", "Measurement under range", "No transmitter"]
+    assert value == [1.0e-3, 2.5e-2, 3.0e2]
+
+    status_out = [0]*3
+    value_out = [0.0]*3
+    controller.get_pressure_into(status_out, value_out)
+    assert status_out == [0, 1, 5]
+    assert value_out == value
+    controller.close()
+
+
+def test_reconnect_reuses_pooled_socket(server):
+    controller = CenterTwo.Controller()
+    controller.connect(server.url, timeout=1)
+    transport = controller.serial_com
+    sock = transport.sock
+    controller.get_pressure()
+
+    controller.reconnect()
+    assert controller.serial_com is transport
+    assert controller.serial_com.sock is sock
+    assert controller.get_pressure()[1] == [1.0e-3, 2.5e-2, 3.0e2]
+    controller.close()
+
+
+def test_dead_pooled_socket_is_a_transport_error(server):
+    controller = CenterTwo.Controller()
+    controller.connect(server.url, timeout=1)
+    controller.serial_com.sock.close()
+    with pytest.raises(CenterTwo.TransportError):
+        controller.get_pressure()
+    with pytest.raises(serial.SerialException):
+        controller.serial_com.write(b"PRX\r\n")
+
+
+@pytest.mark.parametrize("speed", ["0", "-2", "fast"])
+def test_replay_rejects_invalid_speed(tmp_path, speed):
+    log = tmp_path / "log.dat"
+    log.write_text("0.0,1.0e-3\n0.001,2.0e-3\n")
+    with pytest.raises(serial.SerialException):
+        transports.open_transport("replay://{}?speed={}".format(log, speed))
+    controller = CenterTwo.Controller()
+    controller.connect("replay://{}?speed={}".format(log, speed))
+    assert not controller.is_connected
+
+
+def test_malformed_replay_log_does_not_connect(tmp_path):
+    log = tmp_path / "log.dat"
+    log.write_text("0.0,1.0,2.0,3.0,4.0\n")
+    with pytest.raises(serial.SerialException):
+        transports.open_transport("replay://{}".format(log))
+    controller = CenterTwo.Controller()
+    controller.connect("replay://{}".format(log))
+    assert not controller.is_connected
+
+
+def test_replayed_failed_read_is_an_error(tmp_path):
+    # plot_pressure.py layout: time in hours, status, pressure
+    log = tmp_path / "log.dat"
+    log.write_text("0.0,0,1.0e-3\n0.001,-2,nan\n0.002,0,2.0e-3\n0.003,-2,nan\n0.004,0,3.0e-3\n")
+    controller = CenterTwo.Controller()
+    controller.connect("replay://{}?speed=max".format(log), timeout=0.05)
+    assert controller.get_channel_pressure(1) == ["Measurement data ok", 1.0e-3]
+    with pytest.raises(CenterTwo.CenterTwoError):
+        controller.get_channel_pressure(1)
+    assert controller.get_channel_pressure(1) == ["Measurement data ok", 2.0e-3]
+
+    status_out = [0]
+    value_out = [0.0]
+    with pytest.raises(CenterTwo.CenterTwoError):
+        controller.get_channel_pressure_into(1, status_out, value_out)
+    controller.get_channel_pressure_into(1, status_out, value_out)
+    assert status_out == [0]
+    assert value_out == [3.0e-3]
+    controller.close()
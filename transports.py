@@ -0,0 +1,228 @@
+import select
+import socket
+import threading
+from urllib.parse import parse_qs
+import serial
+
+# URL schemes understood by open_transport, anything else is a local serial device
+SOCKET_SCHEMES = ("socket://", "tcp://")
+RFC2217_SCHEME = "rfc2217://"
+REPLAY_SCHEME = "replay://"
+
+RECV_SIZE = 4096
+
+
+def parse_address(url):
+    """
+    Split "socket://host:port" or "tcp://host:port" into (host, port).
+    """
+    address = url.split("://", 1)[1].rstrip("/")
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+class SocketTransport():
+    """
+    Raw TCP connection to an Ethernet terminal server. Implements the subset of
+    the serial.Serial interface used by Controller (write, readline, readinto,
+    in_waiting, reset_input_buffer, close).
+
+    Transports handed out by a ConnectionPool go back to the pool on close();
+    shutdown() closes the socket for good.
+    """
+
+    def __init__(self, host, port, timeout=1, pool=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool = pool
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        # commands are a few bytes long, do not let Nagle hold them back
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self._rx = bytearray()
+        self.is_open = True
+
+    def _receive(self, wait):
+        """
+        Append pending socket data to the receive buffer, waiting at most
+        timeout seconds if wait is True. Returns the number of bytes received.
+        """
+        try:
+            readable, _, _ = select.select([self.sock], [], [], self.timeout if wait else 0)
+            if not readable:
+                return 0
+            data = self.sock.recv(RECV_SIZE)
+        except OSError as error:
+            self.is_open = False
+            raise serial.SerialException("Connection to {}:{} failed: {}".format(self.host, self.port, error)) from error
+        if not data:
+            self.is_open = False
+            raise serial.SerialException("Connection closed by {}:{}".format(self.host, self.port))
+        self._rx += data
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        self._receive(False)
+        return len(self._rx)
+
+    def write(self, data):
+        try:
+            self.sock.sendall(data)
+        except OSError as error:
+            # reported like a failing serial port
+            self.is_open = False
+            raise serial.SerialException("Connection to {}:{} failed: {}".format(self.host, self.port, error)) from error
+        return len(data)
+
+    def readline(self):
+        start = 0
+        while True:
+            eol = self._rx.find(b"\n", start)
+            if eol != -1:
+                line = bytes(self._rx[:eol + 1])
+                del self._rx[:eol + 1]
+                return line
+            start = len(self._rx)
+            if not self._receive(True):
+                # timeout, behave like serial.Serial and return what we have
+                line = bytes(self._rx)
+                self._rx.clear()
+                return line
+
+    def read(self, size=1):
+        while len(self._rx) < size:
+            if not self._receive(True):
+                break
+        data = bytes(self._rx[:size])
+        del self._rx[:size]
+        return data
+
+    def readinto(self, buffer):
+        if not self._rx:
+            self._receive(True)
+        n = min(len(buffer), len(self._rx))
+        buffer[:n] = self._rx[:n]
+        del self._rx[:n]
+        return n
+
+    def reset_input_buffer(self):
+        self._rx.clear()
+        while self._receive(False):
+            self._rx.clear()
+
+    def is_alive(self):
+        """
+        True if the peer has not closed the connection.
+        """
+        if not self.is_open:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if readable and not self.sock.recv(RECV_SIZE, socket.MSG_PEEK):
+                return False
+        except OSError:
+            return False
+        return True
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            self.shutdown()
+
+    def shutdown(self):
+        self.is_open = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool():
+    """
+    Keeps TCP connections to terminal servers open between Controller sessions,
+    so that a reconnect reuses a warm socket instead of opening a new one.
+    """
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, port, timeout=1):
+        """
+        Return an idle live connection to host:port or open a new one.
+        """
+        with self._lock:
+            idle = self._idle.get((host, port), [])
+            while idle:
+                transport = idle.pop()
+                if transport.is_alive():
+                    transport.timeout = timeout
+                    transport.reset_input_buffer()
+                    return transport
+                transport.shutdown()
+        return SocketTransport(host, port, timeout=timeout, pool=self)
+
+    def release(self, transport):
+        """
+        Give a connection back to the pool, closing it if the pool is full.
+        """
+        with self._lock:
+            idle = self._idle.setdefault((transport.host, transport.port), [])
+            if transport.is_alive() and len(idle) < self.max_idle:
+                idle.append(transport)
+                return
+        transport.shutdown()
+
+    def close_all(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for transport in idle:
+                    transport.shutdown()
+            self._idle.clear()
+
+
+# pool shared by all controllers
+POOL = ConnectionPool()
+
+
+def open_transport(url, baudrate=9600, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_TWO, timeout=1, pool=POOL):
+    """
+    Open a transport for url.
+
+    Parameters:
+    url (str): "socket://host:port" or "tcp://host:port" for a raw TCP terminal
+               server (pooled), "rfc2217://host:port" for an RFC2217 server
+               (serial settings are applied remotely), "replay://path?speed=N&loop=1"
+               to replay a recorded log (speed=max for as fast as possible),
+               anything else is opened as a local serial device.
+    """
+    if url.startswith(REPLAY_SCHEME):
+        import replay
+        path, _, query = url[len(REPLAY_SCHEME):].partition("?")
+        options = {k: v[-1] for k, v in parse_qs(query).items()}
+        speed = options.get("speed", "1")
+        if speed == "max":
+            speed = None
+        else:
+            try:
+                speed = float(speed)
+            except ValueError:
+                speed = float("nan")
+            if not speed > 0:
+                raise serial.SerialException("Invalid replay speed {!r}, expected a positive number or max".format(options["speed"]))
+        loop = options.get("loop", "0") in ("1", "true")
+        try:
+            return replay.open_replay(path, speed=speed, loop=loop, timeout=timeout)
+        except ValueError as error:
+            # malformed or empty log, reported like a serial port that cannot be opened
+            raise serial.SerialException("Could not load {}: {}".format(path, error)) from error
+    if url.startswith(SOCKET_SCHEMES):
+        host, port = parse_address(url)
+        return pool.acquire(host, port, timeout=timeout)
+    if url.startswith(RFC2217_SCHEME):
+        return serial.serial_for_url(url, baudrate=baudrate, parity=parity, stopbits=stopbits, timeout=timeout)
+    return serial.Serial(port=url, baudrate=baudrate, timeout=timeout, parity=parity, stopbits=stopbits)